@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+整理流程基准测试
+
+在临时目录中生成合成的 Downloads 目录树，分别计时以下阶段：
+  plan     计算移动计划（calculate_moves：扫描、分类、冲突处理）
+  execute  执行移动（execute_moves）
+  history  写入历史记录（start_new_batch / add_to_batch / sync_history）
+  undo     撤销整批（undo_last_batch）
+  watch    监控模式的事件处理（FileHandler：调度、稳定性检查、移动并记录）
+结果以 JSON 输出（含每个文件的平均耗时），便于比较不同版本发现热路径回归。
+
+目录树形状：
+  flat        所有文件都在 Downloads 顶层
+  deep        文件分散在多层子目录中（递归扫描）
+  collisions  大量同名文件分散在不同子目录，且目标文件夹中已有同名文件
+  mixed       覆盖 CATEGORIES 中所有扩展名，另含智能分类关键词、未知扩展名和应跳过的文件
+
+使用方法：
+  python benchmarks/bench_organize.py
+  python benchmarks/bench_organize.py --shape flat --files 100000 --output flat.json
+  python benchmarks/bench_organize.py --history-backend sqlite --jobs 4
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import organize_downloads as od  # noqa: E402
+
+SHAPES = ["flat", "deep", "collisions", "mixed"]
+PHASES = ["plan", "execute", "history", "undo", "watch"]
+
+EXTENSIONS = sorted({ext for exts in od.CATEGORIES.values() for ext in exts})
+KEYWORDS = sorted({kw for rules in od.SMART_RULES.values() for keywords, _ in rules for kw in keywords})
+
+
+class FakeEvent:
+    """模拟 watchdog 的文件创建事件"""
+    event_type = "created"
+    is_directory = False
+
+    def __init__(self, src_path: str):
+        self.src_path = src_path
+
+
+def generate_tree(shape: str, root: Path, count: int, depth: int, rng: random.Random):
+    """在 root 下生成 count 个空文件，返回 Downloads 是否需要递归扫描"""
+    downloads = root / "Downloads"
+    downloads.mkdir(parents=True)
+
+    if shape == "flat":
+        for i in range(count):
+            (downloads / f"file_{i:07d}{rng.choice(EXTENSIONS)}").touch()
+        return False
+
+    if shape == "deep":
+        # 每层最多 8 个子目录，平均每个目录约 20 个文件，文件轮流放入各层目录
+        folders = [downloads]
+        level = [downloads]
+        limit = max(1, count // 20)
+        for d in range(depth):
+            level = [folder / f"d{d}_{j}" for folder in level for j in range(8)][:limit]
+            folders += level
+        for folder in folders:
+            folder.mkdir(parents=True, exist_ok=True)
+        for i in range(count):
+            (folders[i % len(folders)] / f"file_{i:07d}{rng.choice(EXTENSIONS)}").touch()
+        return True
+
+    if shape == "collisions":
+        # 约 1% 的不同文件名，分散在 100 个子目录中；目标文件夹中预先放入同名文件
+        names = [f"report{rng.choice(['.pdf', '.docx', '.png', '.zip'])}" if i == 0 else
+                 f"report ({i}){rng.choice(['.pdf', '.docx', '.png', '.zip'])}" for i in range(max(1, count // 100))]
+        folders = [downloads / f"batch_{j:03d}" for j in range(100)]
+        for folder in folders:
+            folder.mkdir()
+        for i in range(count):
+            (folders[i % len(folders)] / names[(i // len(folders)) % len(names)]).touch()
+        for name in names:
+            dest = root / "Documents" / od.get_category(name) / name
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            dest.touch()
+        return True
+
+    if shape == "mixed":
+        extras = [".unknown", ".bin", ""]
+        skipped = [".crdownload", ".part", ".tmp"]
+        for i in range(count):
+            roll = rng.random()
+            if roll < 0.05:
+                name = f"file_{i:07d}.pdf{rng.choice(skipped)}"
+            elif roll < 0.10:
+                name = f"file_{i:07d}{rng.choice(extras)}"
+            elif roll < 0.40:
+                name = f"{rng.choice(KEYWORDS)}_{i:07d}{rng.choice(EXTENSIONS)}"
+            else:
+                name = f"file_{i:07d}{rng.choice(EXTENSIONS)}"
+            (downloads / name).touch()
+        return False
+
+    raise ValueError(f"未知的目录树形状: {shape}")
+
+
+def configure(root: Path, recursive: bool, args) -> dict:
+    """把模块配置指向临时目录，返回源文件夹配置"""
+    od.TARGET_ROOT = root / "Documents"
+    od.TARGET_ROOT.mkdir(exist_ok=True)
+    od.HISTORY_FILE = root / ".config" / "download-organizer" / "organize_history.json"
+    od.HISTORY_FILE.parent.mkdir(parents=True)
+    od.HISTORY_BACKEND = args.history_backend
+    od.SCAN_WORKERS = args.scan_workers
+    od.MOVE_WORKERS = args.jobs
+    od.ARCHIVE_BY_DATE = args.archive_by_date
+    od.INCREMENTAL_SCAN = False
+    od.DEDUPE = False
+    return {
+        "Downloads": {"path": root / "Downloads", "recursive": recursive},
+        "Documents": {"path": od.TARGET_ROOT, "recursive": False},
+    }
+
+
+def phase_result(seconds: float, files: int) -> dict:
+    return {
+        "seconds": round(seconds, 6),
+        "files": files,
+        "us_per_file": round(seconds / files * 1e6, 3) if files else None,
+    }
+
+
+def run_watch(source_folders: dict, limit: int) -> dict:
+    """把 Downloads 中的文件当作新下载，通过 FileHandler 处理一遍"""
+    config = source_folders["Downloads"]
+    scheduler = od.PendingScheduler()
+    handler = od.FileHandler(config["path"], od.TARGET_ROOT, "Downloads", config["recursive"], scheduler)
+    paths = [entry.path for entry in od.iter_source_files(config["path"], config["recursive"], od.TARGET_ROOT)]
+    paths = paths[:limit]
+
+    start = time.perf_counter()
+    for path in paths:
+        handler.dispatch(FakeEvent(path))
+    # 第一轮到期记录快照，第二轮确认稳定后整理（不等待真实的延迟）
+    for _ in range(2):
+        for due_handler, path in scheduler.pop_due(float("inf")):
+            due_handler.process_due(path)
+    elapsed = time.perf_counter() - start
+    return phase_result(elapsed, len(paths))
+
+
+def run_shape(shape: str, args) -> dict:
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory(prefix=f"bench-{shape}-") as tmp:
+        root = Path(tmp)
+        start = time.perf_counter()
+        recursive = generate_tree(shape, root, args.files, args.depth, rng)
+        generate_seconds = time.perf_counter() - start
+        source_folders = configure(root, recursive, args)
+        phases = {}
+        quiet = contextlib.redirect_stdout(io.StringIO())
+
+        with quiet:
+            start = time.perf_counter()
+            stats, skipped = od.calculate_moves(source_folders, od.TARGET_ROOT)
+            planned = [f for files in stats.values() for f in files]
+            phases["plan"] = phase_result(time.perf_counter() - start, len(planned))
+
+            start = time.perf_counter()
+            results = list(od.execute_moves(planned, od.MOVE_WORKERS))
+            phases["execute"] = phase_result(time.perf_counter() - start, len(planned))
+            moved = [f for f, error in results if error is None]
+
+            start = time.perf_counter()
+            od.start_new_batch()
+            for f in moved:
+                od.add_to_batch(f.source, f.dest)
+            od.sync_history()
+            phases["history"] = phase_result(time.perf_counter() - start, len(moved))
+
+            start = time.perf_counter()
+            od.undo_last_batch()
+            phases["undo"] = phase_result(time.perf_counter() - start, len(moved))
+
+            phases["watch"] = run_watch(source_folders, args.watch_files)
+
+        od.get_history_store().close()
+
+    return {
+        "files": args.files,
+        "planned": len(planned),
+        "skipped": len(skipped),
+        "moved": len(moved),
+        "categories": len(stats),
+        "generate_seconds": round(generate_seconds, 3),
+        "phases": {name: phases[name] for name in PHASES if name in args.phases},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="organize_downloads.py 整理流程基准测试")
+    parser.add_argument("--shape", choices=SHAPES + ["all"], default="all", help="目录树形状（默认全部）")
+    parser.add_argument("--files", type=int, default=10000, help="每种形状生成的文件数")
+    parser.add_argument("--depth", type=int, default=6, help="deep 形状的目录层数")
+    parser.add_argument("--watch-files", type=int, default=2000, help="监控阶段处理的文件数上限")
+    parser.add_argument("--phases", nargs="+", choices=PHASES, default=PHASES, help="输出的阶段")
+    parser.add_argument("--history-backend", choices=sorted(od.HISTORY_BACKENDS), default=od.HISTORY_BACKEND)
+    parser.add_argument("--scan-workers", type=int, default=1)
+    parser.add_argument("--jobs", "-j", type=int, default=1)
+    parser.add_argument("--archive-by-date", action="store_true", help="启用按日期归档")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子（保证不同版本生成相同的目录树）")
+    parser.add_argument("--output", "-o", type=Path, help="把结果写入文件（默认输出到标准输出）")
+    args = parser.parse_args()
+
+    report = {
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "config": {
+            "files": args.files,
+            "history_backend": args.history_backend,
+            "scan_workers": args.scan_workers,
+            "jobs": args.jobs,
+            "archive_by_date": args.archive_by_date,
+            "seed": args.seed,
+        },
+        "shapes": {},
+    }
+    for shape in (SHAPES if args.shape == "all" else [args.shape]):
+        print(f"⏱️  {shape}: {args.files} 个文件...", file=sys.stderr)
+        report["shapes"][shape] = run_shape(shape, args)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+启动耗时检查
+
+用 `python -X importtime` 运行 organize_downloads.py 的轻量命令（--history、--undo、预览），
+统计导入耗时，并确认只有部分命令需要的重型模块没有在启动时被加载。
+结果以 JSON 输出；发现回归时退出码为 1，可用于 CI。
+
+使用方法：
+  python benchmarks/bench_startup.py
+  python benchmarks/bench_startup.py --repeat 10 --max-import-ms 80
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+SCRIPT = Path(__file__).resolve().parent.parent / "organize_downloads.py"
+
+# 这些模块只在监控、sqlite 历史、去重、并行等模式下使用，不应在启动时导入
+DEFERRED_MODULES = ["watchdog", "sqlite3", "hashlib", "concurrent.futures"]
+
+COMMANDS = {
+    "import": ["-c", f"import sys; sys.path.insert(0, {str(SCRIPT.parent)!r}); import organize_downloads"],
+    "history": [str(SCRIPT), "--history"],
+    "undo": [str(SCRIPT), "--undo"],
+    "preview": [str(SCRIPT), "--path", "{home}/Downloads"],
+}
+
+
+def parse_importtime(stderr: str) -> dict:
+    """解析 -X importtime 输出，返回 {模块名: (自身耗时us, 累计耗时us)}"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def run_command(name: str, home: str) -> dict:
+    """运行一次命令，返回导入统计"""
+    args = [arg.replace("{home}", home) for arg in COMMANDS[name]]
+    env = dict(os.environ, HOME=home, USERPROFILE=home)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    modules = parse_importtime(result.stderr)
+    total_us = sum(self_us for self_us, _ in modules.values())
+    # 以脚本方式运行时主模块不计入 importtime，只有 "import" 命令有这一项
+    own_us = modules.get("organize_downloads", (None, None))[1]
+    loaded = [m for m in DEFERRED_MODULES if any(n == m or n.startswith(m + ".") for n in modules)]
+    return {"returncode": result.returncode, "total_us": total_us, "module_us": own_us,
+            "modules": modules, "deferred_loaded": loaded}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查 organize_downloads.py 的启动耗时")
+    parser.add_argument("--repeat", type=int, default=5, help="每个命令运行的次数（取中位数）")
+    parser.add_argument("--top", type=int, default=10, help="输出累计耗时最高的模块数")
+    parser.add_argument("--max-import-ms", type=float, default=None,
+                        help="导入总耗时上限（毫秒），超出视为回归")
+    args = parser.parse_args()
+
+    report = {"python": sys.version.split()[0], "commands": {}}
+    failed = False
+
+    with tempfile.TemporaryDirectory() as home:
+        (Path(home) / "Downloads").mkdir()
+        for name in COMMANDS:
+            runs = [run_command(name, home) for _ in range(args.repeat)]
+            last = runs[-1]
+            top = sorted(last["modules"].items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+            total_ms = statistics.median(run["total_us"] for run in runs) / 1000
+            entry = {
+                "import_total_ms": round(total_ms, 2),
+                "deferred_modules_loaded": last["deferred_loaded"],
+                "top_modules": [{"module": m, "cumulative_ms": round(c / 1000, 2)} for m, (_, c) in top],
+            }
+            if last["module_us"] is not None:
+                entry["organize_downloads_ms"] = round(
+                    statistics.median(run["module_us"] for run in runs) / 1000, 2)
+            if last["returncode"] != 0 or last["deferred_loaded"]:
+                failed = True
+            if args.max_import_ms is not None and total_ms > args.max_import_ms:
+                failed = True
+            report["commands"][name] = entry
+
+    report["ok"] = not failed
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
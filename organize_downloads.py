@@ -21,26 +21,32 @@
 
 import os
 import sys
+import errno
 import json
 import shutil
 import argparse
-import re
+import heapq
+import itertools
+import threading
 import time
 from pathlib import Path
 from datetime import datetime
-from collections import defaultdict
-from typing import Optional, Dict, List, Tuple
+from collections import defaultdict, OrderedDict
+from typing import TYPE_CHECKING, Optional, Dict, Iterable, List, Tuple
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+if TYPE_CHECKING:  # 仅用于类型注解，运行时不导入
+    from concurrent.futures import ThreadPoolExecutor
 
 try:
-    from watchdog.observers import Observer
-    from watchdog.events import FileSystemEventHandler, FileCreatedEvent, FileMovedEvent
-    WATCHDOG_AVAILABLE = True
-except ImportError:
-    WATCHDOG_AVAILABLE = False
-    # 定义空基类以避免语法错误
-    class FileSystemEventHandler:
-        pass
-    Observer = None
+    import fcntl
+except ImportError:  # Windows：没有 fcntl，历史日志写入不加锁
+    fcntl = None
+
+# 只有部分命令用到的模块（watchdog、sqlite3、hashlib、concurrent.futures）
+# 在使用处按需导入，--history / --undo 等命令启动时不加载。
+# 启动耗时可用 benchmarks/bench_startup.py 检查。
 
 # ============ 配置 ============
 
@@ -59,9 +65,57 @@ TARGET_ROOT = Path.home() / "Documents"
 # 历史记录文件（集中存储）
 HISTORY_FILE = Path.home() / ".config" / "download-organizer" / "organize_history.json"
 
+# 历史存储后端："journal"（追加式日志）或 "sqlite"（带索引的数据库，适合大量历史）
+HISTORY_BACKEND = "journal"
+
 # 是否按日期归档（True: 文档/2026-01/file.pdf, False: 文档/file.pdf）
 ARCHIVE_BY_DATE = False
 
+# 并行扫描目录的线程数（1 表示单线程；网络文件系统上列目录受延迟限制，可适当调大）
+SCAN_WORKERS = 1
+
+# 增量扫描：记录每个目录的 mtime 和子项列表，未变化的目录不再重新列出
+INCREMENTAL_SCAN = False
+
+# 并行移动文件的线程数（1 表示逐个移动；同设备重命名与跨设备复制各用一个线程池）
+MOVE_WORKERS = 1
+
+# 跨设备复制的分块大小；超过一块的文件会记录进度，中断后可从断点继续
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+# 没有可读进度记录的复制临时文件超过这么久（秒）未修改，视为中断留下的残留
+STALE_COPY_SECONDS = 24 * 3600
+
+# 去重模式：与目标文件夹中已有文件内容完全相同的文件不再移动（保留在原处并报告）
+DEDUPE = False
+
+# 文件哈希缓存的最大条目数（超出后淘汰最久未使用的条目）
+HASH_CACHE_MAX_ENTRIES = 100000
+
+# 目标目录缓存的最大条目数（分类 × 子分类 × 日期的组合通常只有几百种）
+DEST_FOLDER_CACHE_SIZE = 4096
+
+# 流式整理时重名判断最多缓存的目标目录文件名数（超出后淘汰最久未用的目录，用到时重新列出）
+STREAM_NAME_CACHE_MAX_ENTRIES = 100000
+
+# 流式整理时去重检测最多登记的目标文件数（超出后淘汰最久未用的目标文件夹，用到时重新列出）
+STREAM_DEDUPE_MAX_ENTRIES = 100000
+
+# 流式整理：边扫描边移动，只保留汇总统计，内存占用不随文件数增长（适合上百万个文件）
+STREAM_PLAN = False
+
+# 性能统计：记录热路径各环节的调用次数和耗时，整理结束时输出（监控模式下定期输出）
+COLLECT_STATS = False
+
+# 监控模式下输出性能统计的间隔（秒）
+STATS_INTERVAL = 60
+
+# --profile 摘要中列出的热点函数数量
+PROFILE_TOP = 30
+
+# 监控模式采样分析的采样间隔（秒）
+PROFILE_SAMPLE_INTERVAL = 0.005
+
 # ============ 分类规则 ============
 
 CATEGORIES = {
@@ -71,7 +125,8 @@ CATEGORIES = {
     "演示文稿": [".pptx", ".ppt"],
     "文本文件": [".txt"],
     "图片": [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".heic", ".svg", ".tiff"],
-    "安装包": [".dmg", ".pkg", ".app", ".exe", ".msi", ".zip", ".rar", ".7z", ".tar", ".gz", ".bz2"],
+    "安装包": [".dmg", ".pkg", ".app", ".exe", ".msi", ".zip", ".rar", ".7z", ".tar", ".gz", ".bz2",
+            ".tgz", ".tar.gz", ".tar.bz2", ".tar.xz"],
     "视频": [".mp4", ".mov", ".avi", ".mkv", ".wmv", ".flv"],
     "音频": [".mp3", ".wav", ".flac", ".aac", ".m4a"],
     "代码": [".py", ".js", ".ts", ".html", ".css", ".json", ".xml", ".yaml", ".yml"],
@@ -138,36 +193,131 @@ SKIP_PATTERNS = [
     ".tmp",
 ]
 
-# ============ 核心逻辑 ============
+# ============ 规则索引 ============
 
-def get_category(filename: str) -> str:
-    """根据文件扩展名获取基础分类"""
-    ext = Path(filename).suffix.lower()
+# 扩展名 → 分类 的反向索引（由 compile_rules 根据 CATEGORIES 生成）
+EXTENSION_INDEX: Dict[str, str] = {}
+
+# 索引中扩展名包含的最多的点数（.tar.gz 为 2）
+MAX_EXTENSION_DOTS = 1
+
+# 分类 → 关键词匹配器（由 compile_rules 根据 SMART_RULES 生成）
+SMART_MATCHERS: Dict[str, "KeywordMatcher"] = {}
+
+
+class KeywordMatcher:
+    """Aho-Corasick 多模式匹配器
+
+    把一个分类下所有规则的关键词编译成一个自动机，对小写文件名扫描一遍即可
+    找到所有命中的关键词，并返回最靠前（优先级最高）的规则对应的子分类。
+    """
+
+    def __init__(self, rules: List[Tuple[List[str], str]]):
+        self.subcategories = [subcategory for _, subcategory in rules]
+        no_match = len(rules)
+        goto = [{}]         # 状态转移
+        best = [no_match]   # 到达该状态时命中的最靠前规则序号
+
+        for rule_index, (keywords, _) in enumerate(rules):
+            for keyword in keywords:
+                node = 0
+                for ch in keyword.lower():
+                    if ch not in goto[node]:
+                        goto.append({})
+                        best.append(no_match)
+                        goto[node][ch] = len(goto) - 1
+                    node = goto[node][ch]
+                best[node] = min(best[node], rule_index)
+
+        # 广度优先构建失配指针，并把后缀状态的命中结果合并进来
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for node in queue:
+            for ch, child in goto[node].items():
+                state = fail[node]
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(ch, 0)
+                best[child] = min(best[child], best[fail[child]])
+                queue.append(child)
+
+        self._goto = goto
+        self._fail = fail
+        self._best = best
+
+    def match(self, text: str) -> Optional[str]:
+        """返回 text（已小写）命中的最高优先级子分类"""
+        goto, fail, best = self._goto, self._fail, self._best
+        result = best[0]  # 空关键词总是命中
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if best[node] < result:
+                result = best[node]
+                if result == 0:
+                    break
+        return self.subcategories[result] if result < len(self.subcategories) else None
+
+
+def compile_rules():
+    """根据分类规则重建索引（修改 CATEGORIES / SMART_RULES 后需重新调用）"""
+    global ORGANIZED_FOLDER_NAMES, MAX_EXTENSION_DOTS
+
+    EXTENSION_INDEX.clear()
     for category, extensions in CATEGORIES.items():
-        if ext in extensions:
-            return category
-    return "其他"
+        for ext in extensions:
+            # 与原先按顺序查找一致：同一扩展名出现在多个分类时，取第一个
+            EXTENSION_INDEX.setdefault(ext.lower(), category)
 
+    MAX_EXTENSION_DOTS = max((ext.count(".") for ext in EXTENSION_INDEX), default=1)
+    ORGANIZED_FOLDER_NAMES = set(CATEGORIES.keys()) | {"其他"}
 
-def get_smart_subcategory(filename: str, category: str) -> Optional[str]:
-    """基于文件名关键词进行智能子分类"""
-    if category not in SMART_RULES:
-        return None
+    SMART_MATCHERS.clear()
+    for category, rules in SMART_RULES.items():
+        SMART_MATCHERS[category] = KeywordMatcher(rules)
 
-    filename_lower = filename.lower()
 
-    for keywords, subcategory in SMART_RULES[category]:
-        for keyword in keywords:
-            if keyword.lower() in filename_lower:
-                return subcategory
+def split_extension(filename: str) -> Tuple[str, str]:
+    """拆分文件名和扩展名，识别规则中的复合扩展名（如 archive.tar.gz → archive, .tar.gz）"""
+    end = len(filename)
+    pos = end
+    for dots in range(1, MAX_EXTENSION_DOTS + 1):
+        pos = filename.rfind(".", 0, pos)
+        if pos <= 0:
+            break
+        if dots > 1 and filename[pos:].lower() in EXTENSION_INDEX:
+            return filename[:pos], filename[pos:]
+
+    # 普通扩展名（与 Path.suffix 规则一致）
+    pos = filename.rfind(".")
+    if 0 < pos < end - 1:
+        return filename[:pos], filename[pos:]
+    return filename, ""
 
-    return None
 
+compile_rules()
 
-def get_date_folder(file_path: Path) -> str:
-    """获取文件的日期文件夹名（如 2026-01）"""
+# ============ 核心逻辑 ============
+
+def get_category(filename: str) -> str:
+    """根据文件扩展名获取基础分类（一次字典查找）"""
+    return EXTENSION_INDEX.get(split_extension(filename)[1].lower(), "其他")
+
+
+def get_smart_subcategory(filename: str, category: str) -> Optional[str]:
+    """基于文件名关键词进行智能子分类（规则靠前者优先）"""
+    matcher = SMART_MATCHERS.get(category)
+    if matcher is None:
+        return None
+    return matcher.match(filename.lower())
+
+
+def get_date_folder(file_path: Path, st: Optional[os.stat_result] = None) -> str:
+    """获取文件的日期文件夹名（如 2026-01），已有 stat 结果时不再重复 stat"""
     try:
-        mtime = file_path.stat().st_mtime
+        mtime = (st or file_path.stat()).st_mtime
         dt = datetime.fromtimestamp(mtime)
         return dt.strftime("%Y-%m")
     except:
@@ -186,222 +336,2039 @@ def should_skip(filename: str) -> bool:
     return False
 
 
-def get_unique_path(dest_path: Path) -> Path:
-    """处理重名文件，返回唯一路径"""
-    if not dest_path.exists():
-        return dest_path
+class DestinationIndex:
+    """规划阶段的目标目录文件名索引
+
+    每个目标目录只列出一次，之后的重名判断（包括本次计划中已分配出去的文件名）
+    都是字典/集合操作，保证同一次规划不会给两个文件分配相同的文件名。
+    文件名按 casefold 比较，在大小写不敏感的文件系统（macOS/Windows）上同样安全；
+    批量、流式和监控模式都按这一规则判断重名，同样的目录树得到同样的文件名。
+    """
+
+    def __init__(self):
+        self._names: Dict[str, set] = {}
+        self._counters: Dict[Tuple[str, str, str], int] = {}
+
+    def _names_in(self, folder: str) -> set:
+        names = self._names.get(folder)
+        if names is None:
+            try:
+                names = {name.casefold() for name in os.listdir(folder)}
+            except OSError:
+                names = set()
+            self._names[folder] = names
+        return names
+
+    def reserve(self, dest_path: Path) -> Path:
+        """返回 dest_path 或加上 _N 后缀的可用路径，并将其标记为已占用"""
+        folder = str(dest_path.parent)
+        names = self._names_in(folder)
+        name = dest_path.name
+        if name.casefold() not in names:
+            names.add(name.casefold())
+            return dest_path
+
+        base, ext = split_extension(name)
+        key = (folder, base.casefold(), ext.casefold())
+        counter = self._counters.get(key, 1)
+        while True:
+            new_name = f"{base}_{counter}{ext}"
+            if new_name.casefold() not in names:
+                break
+            counter += 1
+        self._counters[key] = counter + 1
+        names.add(new_name.casefold())
+        return dest_path.parent / new_name
+
+
+class StreamingDestinationIndex(DestinationIndex):
+    """流式整理的目标文件名索引
+
+    重名规则与 DestinationIndex 相同，但只缓存最近用到的目标目录列表：登记的文件名
+    总数超出 STREAM_NAME_CACHE_MAX_ENTRIES 后淘汰最久未用的目录，再用到时重新列出。
+    已分配、尚未移动完成的文件名另外记住（移动结束后调用 release），重新列出时补上。
+    _N 后缀的起始编号最多缓存 DEST_FOLDER_CACHE_SIZE 条。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._names: "OrderedDict[str, set]" = OrderedDict()
+        self._counters: "OrderedDict[Tuple[str, str, str], int]" = OrderedDict()
+        self._entries = 0  # 缓存的目录列表中的文件名总数
+        self._in_flight: Dict[str, set] = {}
+
+    def _names_in(self, folder: str) -> set:
+        names = self._names.get(folder)
+        if names is not None:
+            self._names.move_to_end(folder)
+            return names
+        names = super()._names_in(folder)
+        names.update(self._in_flight.get(folder, ()))
+        self._entries += len(names)
+        return names
+
+    def reserve(self, dest_path: Path) -> Path:
+        """返回 dest_path 或加上 _N 后缀的可用路径，并在 release 之前将其标记为已占用"""
+        dest_path = super().reserve(dest_path)
+        self._entries += 1
+        self._in_flight.setdefault(str(dest_path.parent), set()).add(dest_path.name.casefold())
+        # 淘汰最久未用的目录（保留刚用到的一个）
+        while self._entries > STREAM_NAME_CACHE_MAX_ENTRIES and len(self._names) > 1:
+            _, names = self._names.popitem(last=False)
+            self._entries -= len(names)
+        while len(self._counters) > DEST_FOLDER_CACHE_SIZE:
+            self._counters.popitem(last=False)
+        return dest_path
+
+    def release(self, dest_path: Path):
+        """移动结束（成功或失败）后释放文件名，之后以目录列表为准"""
+        folder = str(dest_path.parent)
+        names = self._in_flight.get(folder)
+        if names is not None:
+            names.discard(dest_path.name.casefold())
+            if not names:
+                del self._in_flight[folder]
+
+
+def get_unique_path(dest_path: Path, index: Optional[DestinationIndex] = None) -> Path:
+    """处理重名文件，返回唯一路径
+
+    按 DestinationIndex 的规则（casefold 比较）判断重名；传入 index 时复用其中的
+    目录列表和已分配的文件名，否则临时列出目标目录（监控模式逐个文件处理）。
+    """
+    if index is None:
+        index = DestinationIndex()
+    return index.reserve(dest_path)
+
+
+class DirectoryTable:
+    """目录驻留表：每个不同的目录只保存一个 Path，计划项中只记录整数 ID
+
+    一次整理中成千上万个文件通常只来自/去往几十个目录，按目录驻留后
+    计划项不再各自持有完整路径。每次规划使用各自的表；每次 intern 计一次引用，
+    release 到零时移除该目录（流式整理在移动结束后释放，表中只剩在途计划项的目录）。
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._entries: Dict[int, list] = {}  # ID → [Path, 登记键, 引用数]
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def intern(self, folder) -> int:
+        """返回目录（Path 或字符串）的 ID 并增加一次引用，首次出现时登记
+
+        按 os.path.normcase 后的路径登记，ID 相同与 Path 相等的判定一致
+        （Windows 上不区分大小写）。
+        """
+        key = os.path.normcase(os.fspath(folder))
+        folder_id = self._ids.get(key)
+        if folder_id is None:
+            folder_id = self._ids[key] = self._next_id
+            self._next_id += 1
+            self._entries[folder_id] = [folder if isinstance(folder, Path) else Path(folder), key, 1]
+        else:
+            self._entries[folder_id][2] += 1
+        return folder_id
+
+    def release(self, folder_id: int):
+        """减少一次引用，归零时移除该目录"""
+        entry = self._entries[folder_id]
+        entry[2] -= 1
+        if entry[2] == 0:
+            del self._entries[folder_id]
+            del self._ids[entry[1]]
+
+    def path(self, folder_id: int) -> Path:
+        return self._entries[folder_id][0]
+
+
+class PlannedMove:
+    """计划中的一次移动
+
+    用 __slots__ 代替字典，源/目标目录存为本次规划的 DirectoryTable 中的 ID，
+    文件名、日期文件夹、来源名等字符串在计划项之间共享；
+    source / dest 在使用时才拼成 Path。
+    """
+
+    __slots__ = ("dirs", "source_dir", "source_name", "dest_dir", "dest_name",
+                 "size", "date_folder", "source_folder", "same_device")
+
+    def __init__(self, dirs: DirectoryTable, source_dir: int, source_name: str, dest_dir: int,
+                 dest_name: str, size: int, date_folder: Optional[str], source_folder: str,
+                 same_device: bool):
+        self.dirs = dirs
+        self.source_dir = source_dir
+        self.source_name = source_name
+        self.dest_dir = dest_dir
+        self.dest_name = dest_name
+        self.size = size
+        self.date_folder = date_folder
+        self.source_folder = source_folder
+        self.same_device = same_device
+
+    @property
+    def source(self) -> Path:
+        return self.dirs.path(self.source_dir) / self.source_name
+
+    @property
+    def dest_folder(self) -> Path:
+        return self.dirs.path(self.dest_dir)
+
+    @property
+    def dest(self) -> Path:
+        return self.dirs.path(self.dest_dir) / self.dest_name
+
+
+def format_size(size: int) -> str:
+    """格式化文件大小"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+# (目标根目录, 分类, 子分类, 日期文件夹) → (目标目录, 显示分类名)，按最近使用淘汰
+_dest_folder_cache: "OrderedDict[Tuple, Tuple[Path, str]]" = OrderedDict()
+
+
+def build_dest_path(filename: str, file_path: Path, target_root: Path,
+                    st: Optional[os.stat_result] = None) -> Tuple[Path, str]:
+    """计算文件的目标路径和显示分类名
+
+    目标目录按 (目标根目录, 分类, 子分类, 日期文件夹) 缓存，同一组合的文件共用
+    同一个 Path 实例。
+
+    Returns:
+        (dest_folder, display_category)
+    """
+    category = get_category(filename)
+    subcategory = get_smart_subcategory(filename, category)
+    date_folder = get_date_folder(file_path, st) if ARCHIVE_BY_DATE else None
+
+    key = (os.fspath(target_root), category, subcategory, date_folder)
+    cached = _dest_folder_cache.get(key)
+    if cached is not None:
+        _dest_folder_cache.move_to_end(key)
+        return cached
+
+    if subcategory and date_folder:
+        dest_folder = target_root / category / subcategory / date_folder
+    elif subcategory:
+        dest_folder = target_root / category / subcategory
+    elif date_folder:
+        dest_folder = target_root / category / date_folder
+    else:
+        dest_folder = target_root / category
+
+    display_category = f"{category}/{subcategory}" if subcategory else category
+    cached = _dest_folder_cache[key] = (dest_folder, display_category)
+    if len(_dest_folder_cache) > DEST_FOLDER_CACHE_SIZE:
+        _dest_folder_cache.popitem(last=False)
+    return cached
+
+
+def is_in_organized_folder(file_path: Path, target_root: Path) -> bool:
+    """检查文件是否已在目标根目录的已整理子文件夹中"""
+    try:
+        rel = file_path.relative_to(target_root)
+        if len(rel.parts) > 1 and rel.parts[0] in ORGANIZED_FOLDER_NAMES:
+            return True
+    except ValueError:
+        pass
+    return False
+
+
+# ============ 历史记录管理 ============
+# 两种历史存储后端（HISTORY_BACKEND / --history-backend）：
+#   journal: 追加式日志（JSON Lines），每次移动只追加一行，不再整体重写文件：
+#     {"op": "batch", "batch_id": 1, "timestamp": "..."}        开始新批次
+#     {"op": "move", "batch_id": 1, "source": "...", "dest": "..."}
+#     {"op": "undo", "batch_id": 1}                              撤销（移除）批次
+#   sqlite:  SQLite 数据库，按批次ID、源路径、目标路径建索引
+
+def get_journal_path() -> Path:
+    """历史日志路径（与 HISTORY_FILE 同目录）"""
+    return HISTORY_FILE.with_suffix(".jsonl")
+
+
+def get_history_db_path() -> Path:
+    """SQLite 历史数据库路径（与 HISTORY_FILE 同目录）"""
+    return HISTORY_FILE.with_suffix(".db")
+
+
+class HistoryStore(ABC):
+    """历史存储后端基类
+
+    查询方法的默认实现基于 load()，后端可按需覆盖为更高效的查询。
+    """
+
+    path = None
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def load(self) -> List[Dict]:
+        """全部未撤销的批次 [{"batch_id", "timestamp", "moves": [{"source", "dest"}]}]"""
+
+    @abstractmethod
+    def start_batch(self) -> int:
+        """开始新批次，返回批次ID"""
+
+    @abstractmethod
+    def add_move(self, source: Path, dest: Path):
+        """追加一条移动记录到当前批次"""
+
+    @abstractmethod
+    def sync(self):
+        """将已写入的记录落盘"""
+
+    @abstractmethod
+    def remove_batch(self, batch_id: int):
+        """移除指定批次"""
+
+    @abstractmethod
+    def rewrite(self, history: List[Dict]):
+        """用给定的批次列表整体替换历史"""
+
+    @abstractmethod
+    def last_batch(self) -> Optional[Tuple[int, str]]:
+        """当前写入批次的 (batch_id, timestamp)，record_move 据此决定是否开始新批次"""
+
+    def record_move(self, source: Path, dest: Path):
+        """记录一次移动操作（60秒内的移动归入同一批次）"""
+        last = self.last_batch()
+        if not last or (datetime.now() - datetime.fromisoformat(last[1])).total_seconds() >= 60:
+            self.start_batch()
+        self.add_move(source, dest)
+        self.sync()
+
+    def last_nonempty_batch(self) -> Optional[Dict]:
+        """最后一个包含移动记录的批次"""
+        for batch in reversed(self.load()):
+            if batch["moves"]:
+                return batch
+        return None
+
+    def recent_batches(self, limit: int, preview: int) -> List[Dict]:
+        """最近 limit 个批次（新到旧），每批只带前 preview 条移动和总数 count"""
+        batches = []
+        for batch in reversed(self.load()[-limit:]):
+            batches.append({
+                "batch_id": batch["batch_id"],
+                "timestamp": batch["timestamp"],
+                "count": len(batch["moves"]),
+                "moves": batch["moves"][:preview],
+            })
+        return batches
+
+    def find_moves(self, path: Path) -> List[Dict]:
+        """查找源路径或目标路径为 path 的所有移动记录"""
+        path_str = str(path)
+        found = []
+        for batch in self.load():
+            for move in batch["moves"]:
+                if move["source"] == path_str or move["dest"] == path_str:
+                    found.append(dict(move, batch_id=batch["batch_id"], timestamp=batch["timestamp"]))
+        return found
+
+
+class HistoryJournal(HistoryStore):
+    """追加式历史日志，批次边界处 fsync
+
+    可能有多个进程同时写入（如常驻的监控模式和定时任务的 -e）：每次写入都在
+    独占文件锁下进行，写入前先回放其他进程追加的记录，批次ID因此不会重复；
+    移动记录只追加到本实例开始的批次，该批次已被其他进程撤销时另开新批次。
+    撤销后已失效的记录（撤销的批次及其移动记录）超过一定数量时，整体重写日志压缩。
+    """
+
+    # 各类记录必须包含的字段，缺字段的记录与无法解析的行一样跳过
+    REQUIRED_FIELDS = {
+        "batch": ("batch_id", "timestamp"),
+        "move": ("batch_id", "source", "dest"),
+        "undo": ("batch_id",),
+    }
+
+    # 失效记录至少这么多、且占日志一半以上时，撤销后压缩日志
+    COMPACT_MIN_DEAD = 1000
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fh = None
+        self._batches = None  # {batch_id: timestamp} 未撤销的批次
+        self._move_counts: Dict[int, int] = {}  # 未撤销批次的移动记录数
+        self._max_batch_id = 0
+        self._records = 0  # 日志中的有效记录数
+        self._dead = 0  # 其中已失效的记录数
+        self._offset = 0  # 已回放到的字节位置
+        self._file_id = None  # 已回放文件的 (st_dev, st_ino)，日志被整体重写后需重新回放
+        self._current = None  # 本实例正在写入的批次ID
+
+    @classmethod
+    def _parse(cls, line) -> Optional[Dict]:
+        """解析一行日志，无法解析或缺少字段时返回 None"""
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(record, dict):
+            return None
+        fields = cls.REQUIRED_FIELDS.get(record.get("op"))
+        if fields is None or any(field not in record for field in fields):
+            return None
+        return record
+
+    def _iter_records(self):
+        """逐行读取日志记录（忽略中断写入留下的残行和格式不对的记录）"""
+        try:
+            f = open(self.path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = self._parse(line)
+                if record is not None:
+                    yield record
+
+    def _apply(self, record: Dict):
+        batch_id = record["batch_id"]
+        op = record["op"]
+        self._records += 1
+        if op == "batch":
+            self._batches[batch_id] = record["timestamp"]
+            self._move_counts[batch_id] = 0
+            self._max_batch_id = max(self._max_batch_id, batch_id)
+        elif op == "move":
+            if batch_id in self._move_counts:
+                self._move_counts[batch_id] += 1
+            else:
+                self._dead += 1
+        elif op == "undo":
+            self._dead += 1
+            if batch_id in self._batches:
+                del self._batches[batch_id]
+                self._dead += 1 + self._move_counts.pop(batch_id)
+
+    def _refresh(self):
+        """回放上次读取之后追加的记录（包括其他进程写入的），只处理完整的行"""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            file_id = (st.st_dev, st.st_ino)
+            if self._batches is None or file_id != self._file_id or st.st_size < self._offset:
+                self._batches = {}
+                self._move_counts = {}
+                self._max_batch_id = 0
+                self._records = 0
+                self._dead = 0
+                self._offset = 0
+                self._file_id = file_id
+            f.seek(self._offset)
+            # 逐行读取，内存占用不随日志大小增长；末尾不完整的行留到下次
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._offset += len(line)
+                record = self._parse(line)
+                if record is not None:
+                    self._apply(record)
+
+    def _ensure_state(self):
+        """读取时同步批次状态"""
+        self._refresh()
+        if self._batches is None:
+            self._batches = {}
+
+    @contextmanager
+    def _locked(self):
+        """独占锁定日志并把批次状态同步到文件末尾，期间可用 _write 追加记录"""
+        while True:
+            if self._fh is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._fh = open(self.path, 'ab', buffering=0)
+            if fcntl is not None:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+            try:
+                same_file = os.path.samestat(os.fstat(self._fh.fileno()), os.stat(self.path))
+            except FileNotFoundError:
+                same_file = False
+            if same_file:
+                break
+            # 日志已被其他进程整体重写（替换为新文件），重新打开
+            self.close()
+        try:
+            st = os.fstat(self._fh.fileno())
+            if self._batches is None or st.st_size != self._offset or \
+                    (st.st_dev, st.st_ino) != self._file_id:
+                self._refresh()
+                if self._offset < st.st_size:
+                    # 中断写入留下的残行：先换行结束它，避免与新记录粘在同一行
+                    self._fh.write(b"\n")
+                    self._offset = st.st_size + 1
+            yield
+        finally:
+            if fcntl is not None and self._fh is not None:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+
+    def _write(self, record: Dict):
+        """追加一条记录（需在 _locked 中调用）"""
+        data = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        self._fh.write(data)
+        self._offset += len(data)
+        self._apply(record)
+
+    def sync(self):
+        """将已追加的记录落盘（批次边界调用）"""
+        if self._fh is not None:
+            os.fsync(self._fh.fileno())
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def load(self) -> List[Dict]:
+        """回放日志，返回与旧版 JSON 相同结构的批次列表"""
+        batches = {}
+        for record in self._iter_records():
+            op = record.get("op")
+            batch_id = record.get("batch_id")
+            if op == "batch":
+                batches[batch_id] = {
+                    "batch_id": batch_id,
+                    "timestamp": record["timestamp"],
+                    "moves": [],
+                }
+            elif op == "move":
+                batch = batches.get(batch_id)
+                if batch is not None:
+                    batch["moves"].append({"source": record["source"], "dest": record["dest"]})
+            elif op == "undo":
+                batches.pop(batch_id, None)
+        return list(batches.values())
+
+    def _start_batch_locked(self) -> int:
+        batch_id = self._max_batch_id + 1
+        self._write({"op": "batch", "batch_id": batch_id, "timestamp": datetime.now().isoformat()})
+        self._current = batch_id
+        return batch_id
+
+    def start_batch(self) -> int:
+        """开始新批次（批次ID在锁内根据日志末尾分配）"""
+        with self._locked():
+            batch_id = self._start_batch_locked()
+        self.sync()
+        return batch_id
+
+    def add_move(self, source: Path, dest: Path):
+        """追加一条移动记录到本实例的当前批次"""
+        with self._locked():
+            if self._current not in self._batches:
+                # 当前批次已被其他进程撤销（或尚未开始），记录到新批次中
+                self._start_batch_locked()
+            self._write({
+                "op": "move",
+                "batch_id": self._current,
+                "source": str(source),
+                "dest": str(dest),
+            })
+
+    def last_batch(self) -> Optional[Tuple[int, str]]:
+        """本实例正在写入且未被撤销的批次"""
+        self._ensure_state()
+        if self._current in self._batches:
+            return self._current, self._batches[self._current]
+        return None
+
+    def remove_batch(self, batch_id: int):
+        """追加撤销记录，移除指定批次；失效记录过多时压缩日志"""
+        with self._locked():
+            self._write({"op": "undo", "batch_id": batch_id})
+            compact = self._dead >= self.COMPACT_MIN_DEAD and self._dead * 2 >= self._records
+            if compact:
+                # 在同一把锁内重新读取并重写，不会丢失其他进程刚追加的记录
+                self._rewrite_locked(self.load())
+        if compact:
+            self._reset()
+        else:
+            self.sync()
+
+    def rewrite(self, history: List[Dict]):
+        """用给定的批次列表整体重写日志（用于迁移/压缩）"""
+        with self._locked():
+            self._rewrite_locked(history)
+        self._reset()
+
+    def _reset(self):
+        """日志被整体重写后关闭旧文件，下次访问时重新回放"""
+        self.close()
+        self._batches = None
+        self._current = None
+
+    def _rewrite_locked(self, history: List[Dict]):
+        """写入临时文件后原子替换日志（需在 _locked 中调用）"""
+        tmp_path = self.path.with_suffix(".jsonl.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for batch in history:
+                f.write(json.dumps({
+                    "op": "batch",
+                    "batch_id": batch["batch_id"],
+                    "timestamp": batch["timestamp"],
+                }, ensure_ascii=False) + "\n")
+                for move in batch["moves"]:
+                    f.write(json.dumps({
+                        "op": "move",
+                        "batch_id": batch["batch_id"],
+                        "source": move["source"],
+                        "dest": move["dest"],
+                    }, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class SQLiteHistory(HistoryStore):
+    """SQLite 历史存储，撤销/历史/路径查询均走索引"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS batches (
+            batch_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS moves (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch_id INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            dest TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_moves_batch ON moves(batch_id);
+        CREATE INDEX IF NOT EXISTS idx_moves_source ON moves(source);
+        CREATE INDEX IF NOT EXISTS idx_moves_dest ON moves(dest);
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            import sqlite3
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path))
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(self.SCHEMA)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+    def sync(self):
+        self.conn.commit()
+
+    def _moves(self, batch_id: int, limit: int = -1) -> List[Dict]:
+        rows = self.conn.execute(
+            "SELECT source, dest FROM moves WHERE batch_id = ? ORDER BY id LIMIT ?",
+            (batch_id, limit),
+        )
+        return [{"source": source, "dest": dest} for source, dest in rows]
+
+    def load(self) -> List[Dict]:
+        batches = {
+            batch_id: {"batch_id": batch_id, "timestamp": timestamp, "moves": []}
+            for batch_id, timestamp in self.conn.execute(
+                "SELECT batch_id, timestamp FROM batches ORDER BY batch_id")
+        }
+        for batch_id, source, dest in self.conn.execute(
+                "SELECT batch_id, source, dest FROM moves ORDER BY id"):
+            if batch_id in batches:
+                batches[batch_id]["moves"].append({"source": source, "dest": dest})
+        return list(batches.values())
+
+    def last_batch(self) -> Optional[Tuple[int, str]]:
+        return self.conn.execute(
+            "SELECT batch_id, timestamp FROM batches ORDER BY batch_id DESC LIMIT 1").fetchone()
+
+    def start_batch(self) -> int:
+        cursor = self.conn.execute(
+            "INSERT INTO batches (timestamp) VALUES (?)", (datetime.now().isoformat(),))
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def add_move(self, source: Path, dest: Path):
+        last = self.last_batch()
+        if last:
+            self.conn.execute(
+                "INSERT INTO moves (batch_id, source, dest) VALUES (?, ?, ?)",
+                (last[0], str(source), str(dest)),
+            )
+
+    def remove_batch(self, batch_id: int):
+        with self.conn:
+            self.conn.execute("DELETE FROM moves WHERE batch_id = ?", (batch_id,))
+            self.conn.execute("DELETE FROM batches WHERE batch_id = ?", (batch_id,))
+
+    def rewrite(self, history: List[Dict]):
+        with self.conn:
+            self.conn.execute("DELETE FROM moves")
+            self.conn.execute("DELETE FROM batches")
+            for batch in history:
+                self.conn.execute(
+                    "INSERT INTO batches (batch_id, timestamp) VALUES (?, ?)",
+                    (batch["batch_id"], batch["timestamp"]),
+                )
+                self.conn.executemany(
+                    "INSERT INTO moves (batch_id, source, dest) VALUES (?, ?, ?)",
+                    [(batch["batch_id"], m["source"], m["dest"]) for m in batch["moves"]],
+                )
+
+    def last_nonempty_batch(self) -> Optional[Dict]:
+        row = self.conn.execute(
+            "SELECT batch_id, timestamp FROM batches b"
+            " WHERE EXISTS (SELECT 1 FROM moves m WHERE m.batch_id = b.batch_id)"
+            " ORDER BY batch_id DESC LIMIT 1").fetchone()
+        if row is None:
+            return None
+        return {"batch_id": row[0], "timestamp": row[1], "moves": self._moves(row[0])}
+
+    def recent_batches(self, limit: int, preview: int) -> List[Dict]:
+        rows = self.conn.execute(
+            "SELECT batch_id, timestamp,"
+            " (SELECT COUNT(*) FROM moves m WHERE m.batch_id = b.batch_id)"
+            " FROM batches b ORDER BY batch_id DESC LIMIT ?", (limit,)).fetchall()
+        return [
+            {"batch_id": batch_id, "timestamp": timestamp, "count": count,
+             "moves": self._moves(batch_id, preview)}
+            for batch_id, timestamp, count in rows
+        ]
+
+    def find_moves(self, path: Path) -> List[Dict]:
+        rows = self.conn.execute(
+            "SELECT m.batch_id, b.timestamp, m.source, m.dest FROM moves m"
+            " JOIN batches b ON b.batch_id = m.batch_id"
+            " WHERE m.source = ? OR m.dest = ? ORDER BY m.id", (str(path), str(path)))
+        return [
+            {"batch_id": batch_id, "timestamp": timestamp, "source": source, "dest": dest}
+            for batch_id, timestamp, source, dest in rows
+        ]
+
+
+HISTORY_BACKENDS = {
+    "journal": (HistoryJournal, get_journal_path),
+    "sqlite": (SQLiteHistory, get_history_db_path),
+}
+
+_history_store = None
+
+
+def get_history_store() -> HistoryStore:
+    """获取当前历史存储（HISTORY_BACKEND 或 HISTORY_FILE 变更时重新打开）"""
+    global _history_store
+    store_class, get_path = HISTORY_BACKENDS[HISTORY_BACKEND]
+    path = get_path()
+    if not isinstance(_history_store, store_class) or _history_store.path != path:
+        if _history_store is not None:
+            _history_store.close()
+        _history_store = store_class(path)
+    return _history_store
+
+
+def migrate_history_if_needed():
+    """迁移旧历史记录：旧位置 → 集中位置，JSON 数组 → 追加式日志（仅一次）
+
+    无论本次使用哪个后端，旧 JSON 都先转为日志；sqlite 后端再由
+    select_history_backend() 从日志导入。
+    """
+    journal_path = get_journal_path()
+    if journal_path.exists():
+        return
+
+    old_history = Path.home() / "Downloads" / ".organize_history.json"
+    if old_history.exists() and not HISTORY_FILE.exists():
+        HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(str(old_history), str(HISTORY_FILE))
+
+    if HISTORY_FILE.exists():
+        try:
+            with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+        except (OSError, ValueError):
+            return
+        journal = HistoryJournal(journal_path)
+        journal.rewrite(history)
+        journal.close()
+        # 保留原文件作为备份，避免重复迁移
+        HISTORY_FILE.replace(HISTORY_FILE.with_suffix(".json.bak"))
+
+
+def get_backend_setting_path() -> Path:
+    """保存所选历史后端的文件（与 HISTORY_FILE 同目录）"""
+    return HISTORY_FILE.parent / "history_backend"
+
+
+def select_history_backend(requested: Optional[str] = None):
+    """确定本次使用的历史后端并设置 HISTORY_BACKEND
+
+    --history-backend 指定的后端会保存下来，之后不带该参数的运行沿用同一个后端；
+    没有保存过时，已有 sqlite 数据库则使用 sqlite，否则使用配置中的 HISTORY_BACKEND。
+    切换后端时把原后端的完整历史复制到新后端，撤销和查询始终看到同一份历史。
+    """
+    global HISTORY_BACKEND
+    setting_path = get_backend_setting_path()
+    try:
+        current = setting_path.read_text(encoding="utf-8").strip()
+    except OSError:
+        current = None
+    if current not in HISTORY_BACKENDS:
+        current = "sqlite" if get_history_db_path().exists() else HISTORY_BACKEND
+
+    if requested is not None and requested != current:
+        store_class, get_path = HISTORY_BACKENDS[current]
+        history = []
+        if get_path().exists():
+            old_store = store_class(get_path())
+            history = old_store.load()
+            old_store.close()
+        HISTORY_BACKEND = requested
+        get_history_store().rewrite(history)
+        sync_history()
+        setting_path.parent.mkdir(parents=True, exist_ok=True)
+        setting_path.write_text(requested + "\n", encoding="utf-8")
+        return
+
+    HISTORY_BACKEND = current
+    if requested is not None and not setting_path.exists():
+        setting_path.parent.mkdir(parents=True, exist_ok=True)
+        setting_path.write_text(requested + "\n", encoding="utf-8")
+    _migrate_journal_to_sqlite()
+
+
+def _migrate_journal_to_sqlite():
+    """首次启用 sqlite 后端时，导入已有的日志历史"""
+    if HISTORY_BACKEND != "sqlite" or get_history_db_path().exists():
+        return
+    history = HistoryJournal(get_journal_path()).load()
+    if history:
+        get_history_store().rewrite(history)
+
+
+def load_history() -> List[Dict]:
+    """加载移动历史
+
+    脚本内部直接使用 get_history_store()；保留此函数供导入本模块的外部脚本兼容使用。
+    """
+    try:
+        return get_history_store().load()
+    except (OSError, KeyError):
+        return []
+
+
+def save_history(history: List[Dict]):
+    """保存移动历史（整体重写当前后端的历史）
+
+    脚本内部直接使用 get_history_store()；保留此函数供导入本模块的外部脚本兼容使用。
+    """
+    get_history_store().rewrite(history)
+
+
+def record_move(source: Path, dest: Path):
+    """记录一次移动操作"""
+    get_history_store().record_move(source, dest)
+
+
+def start_new_batch():
+    """开始新的操作批次"""
+    return get_history_store().start_batch()
+
+
+def add_to_batch(source: Path, dest: Path):
+    """添加移动记录到当前批次"""
+    get_history_store().add_move(source, dest)
+
+
+def sync_history():
+    """批次结束时将历史记录落盘"""
+    get_history_store().sync()
+
+
+def remove_batch(batch_id: int):
+    """从历史中移除批次"""
+    get_history_store().remove_batch(batch_id)
+
+
+def find_file_moves(path: Path) -> List[Dict]:
+    """查询某个文件的移动记录（作为源或目标）"""
+    return get_history_store().find_moves(path)
+
+
+# ============ 目录扫描 ============
+
+def scan_directory(dir_path: str) -> List[os.DirEntry]:
+    """列出单个目录（一次 os.scandir）
+
+    DirEntry 自带文件类型，is_file()/is_dir() 通常无需额外 stat；
+    entry.stat() 的结果会缓存在条目上，后续复用不再产生系统调用。
+    """
+    try:
+        with os.scandir(dir_path) as it:
+            return list(it)
+    except OSError:
+        return []
+
+
+def get_scan_index_path() -> Path:
+    """增量扫描索引路径（与 HISTORY_FILE 同目录）"""
+    return HISTORY_FILE.parent / "scan_index.json"
+
+
+class IndexedEntry:
+    """来自扫描索引的目录条目（接口与 os.DirEntry 相同，stat 按需进行）"""
+
+    __slots__ = ("name", "path", "_is_dir", "_stat")
+
+    def __init__(self, dir_path: str, name: str, is_dir: bool):
+        self.name = name
+        self.path = os.path.join(dir_path, name)
+        self._is_dir = is_dir
+        self._stat = None
+
+    def is_dir(self) -> bool:
+        return self._is_dir
+
+    def is_file(self) -> bool:
+        return not self._is_dir
+
+    def stat(self) -> os.stat_result:
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+
+class ScanIndex:
+    """持久化的增量扫描索引
+
+    为每个目录记录 mtime_ns 和子项列表（子目录名以 / 结尾）。目录的 mtime 在
+    其中增删/重命名条目时才会改变，因此 mtime 未变的目录可直接使用记录的列表，
+    只需 stat 目录本身；其中被跳过的文件无需任何 stat。
+    """
+
+    VERSION = 1
+    # mtime 距现在不足该时长的目录不记录，避免同一时间粒度内的修改被漏掉
+    RACY_WINDOW_NS = 2 * 10**9
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._dirs: Dict[str, Dict] = {}
+        self._seen: Dict[str, Dict] = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                self._dirs = data["dirs"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    def list_directory(self, dir_path: str) -> List:
+        """列出目录：mtime 未变时使用索引，否则重新 scandir 并更新索引"""
+        try:
+            mtime_ns = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            return []
+
+        cached = self._dirs.get(dir_path)
+        if cached is not None and cached["mtime_ns"] == mtime_ns:
+            self._seen[dir_path] = cached
+            return [
+                IndexedEntry(dir_path, name[:-1], True) if name.endswith("/")
+                else IndexedEntry(dir_path, name, False)
+                for name in cached["entries"]
+            ]
+
+        entries = scan_directory(dir_path)
+        if mtime_ns < time.time_ns() - self.RACY_WINDOW_NS:
+            names = []
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        names.append(entry.name + "/")
+                    elif entry.is_file():
+                        names.append(entry.name)
+                except OSError:
+                    continue
+            self._seen[dir_path] = {"mtime_ns": mtime_ns, "entries": names}
+        return entries
+
+    def save(self, roots: List[Path]):
+        """保存索引：本次扫描过的根目录下以本次结果为准，其余保留"""
+        root_strs = [str(root) for root in roots]
+        dirs = {
+            path: record for path, record in self._dirs.items()
+            if not any(path == root or path.startswith(root.rstrip(os.sep) + os.sep) for root in root_strs)
+        }
+        dirs.update(self._seen)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": self.VERSION, "dirs": dirs}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def scan_and_stat(dir_path: str, list_dir=scan_directory) -> List[os.DirEntry]:
+    """列出目录并预先 stat 其中待处理的文件（供扫描线程池使用）"""
+    entries = list_dir(dir_path)
+    for entry in entries:
+        try:
+            if entry.is_file() and not should_skip(entry.name):
+                entry.stat()
+        except OSError:
+            pass
+    return entries
+
+
+def iter_source_files(source_path: Path, recursive: bool, target_root: Path,
+                      pool: Optional["ThreadPoolExecutor"] = None,
+                      scan_index: Optional[ScanIndex] = None):
+    """按目录列出顺序深度优先遍历源文件夹，产出文件的 DirEntry
+
+    传入 pool 时，每列出一个目录就把它的子目录提交到线程池并发列出（预取），
+    主线程仍按单线程时的顺序消费结果，因此产出顺序与单线程完全一致。
+    传入 scan_index 时，mtime 未变化的目录直接使用索引中的列表。
+    """
+    target_root_str = str(target_root)
+    list_dir = scan_index.list_directory if scan_index is not None else scan_directory
+
+    def subdirs_of(dir_path: str, entries: List[os.DirEntry]) -> List[os.DirEntry]:
+        if not recursive:
+            return []
+        subdirs = []
+        for entry in entries:
+            try:
+                if not entry.is_dir():
+                    continue
+            except OSError:
+                continue
+            # 跳过隐藏文件夹和.app包
+            if entry.name.startswith(".") or entry.name.endswith(".app"):
+                continue
+            # 当源文件夹就是目标根目录时，跳过已整理的分类文件夹
+            if dir_path == target_root_str and entry.name in ORGANIZED_FOLDER_NAMES:
+                continue
+            subdirs.append(entry)
+        return subdirs
+
+    def walk(dir_path: str, entries: List[os.DirEntry]):
+        subdirs = subdirs_of(dir_path, entries)
+        if pool is not None:
+            pending = {entry.path: pool.submit(scan_and_stat, entry.path, list_dir) for entry in subdirs}
+        subdir_paths = {entry.path for entry in subdirs}
+
+        for entry in entries:
+            if entry.path in subdir_paths:
+                if pool is not None:
+                    child_entries = pending.pop(entry.path).result()
+                else:
+                    child_entries = list_dir(entry.path)
+                yield from walk(entry.path, child_entries)
+                continue
+            try:
+                if entry.is_file():
+                    yield entry
+            except OSError:
+                continue
+
+    root = str(source_path)
+    yield from walk(root, scan_and_stat(root, list_dir) if pool is not None else list_dir(root))
+
+
+# ============ 文件移动 ============
+
+# 这些错误表示当前内核/文件系统不支持该零拷贝方式，需换用下一种
+_ZERO_COPY_FALLBACK_ERRNOS = {
+    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EBADF, errno.ENOTSOCK,
+    errno.EOPNOTSUPP, getattr(errno, "ENOTSUP", errno.EOPNOTSUPP),
+}
+_unsupported_copy_methods = set()
+# 只有 Linux 的 sendfile 能写入普通文件（macOS/BSD 只支持写入 socket），与 shutil 的判断一致
+_USE_SENDFILE = hasattr(os, "sendfile") and sys.platform.startswith("linux")
+
+
+def _copy_some(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    """从 src 的 offset 处复制最多 count 字节到 dst 的相同位置，返回复制的字节数
+
+    依次尝试 os.copy_file_range、os.sendfile（Linux 内核零拷贝），最后退回普通读写。
+    """
+    if "copy_file_range" not in _unsupported_copy_methods and hasattr(os, "copy_file_range"):
+        try:
+            return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+        except OSError as e:
+            if e.errno not in _ZERO_COPY_FALLBACK_ERRNOS:
+                raise
+            _unsupported_copy_methods.add("copy_file_range")
+
+    if "sendfile" not in _unsupported_copy_methods and _USE_SENDFILE:
+        try:
+            os.lseek(dst_fd, offset, os.SEEK_SET)
+            return os.sendfile(dst_fd, src_fd, offset, count)
+        except OSError as e:
+            if e.errno not in _ZERO_COPY_FALLBACK_ERRNOS:
+                raise
+            _unsupported_copy_methods.add("sendfile")
+
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    data = os.read(src_fd, min(count, 1024 * 1024))
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    view = memoryview(data)
+    while view:
+        view = view[os.write(dst_fd, view):]
+    return len(data)
+
+
+def _chunk_digest(fd: int, offset: int, length: int) -> str:
+    """计算文件 [offset, offset + length) 范围内数据的 SHA-256"""
+    import hashlib
+
+    digest = hashlib.sha256()
+    os.lseek(fd, offset, os.SEEK_SET)
+    while length > 0:
+        data = os.read(fd, min(length, 1024 * 1024))
+        if not data:
+            break
+        digest.update(data)
+        length -= len(data)
+    return digest.hexdigest()
+
+
+def copy_file_resumable(source: Path, dest: Path):
+    """跨设备复制文件（零拷贝、可断点续传），校验通过后原子地出现在 dest
+
+    数据先写入目标目录中的隐藏临时文件，每复制一块就 fsync 并计算这一块的 SHA-256；
+    大文件把各块摘要写入旁边的进度记录。再次对同一源文件执行时，若源文件大小和
+    修改时间未变，先按记录的摘要重新校验临时文件中已复制的部分，从第一个不一致的块
+    继续。复制完成后再逐块计算源文件的摘要与之比对，全部一致才放到 dest。
+    临时文件以源路径的哈希命名，与最终文件名无关。
+    """
+    import hashlib
+
+    st = os.stat(source)
+    key = hashlib.sha1(str(source).encode("utf-8", "surrogateescape")).hexdigest()[:16]
+    tmp_path = dest.parent / f".organize-{key}.tmp"
+    progress_path = dest.parent / f".organize-{key}.progress"
+    track_progress = st.st_size > COPY_CHUNK_SIZE
+
+    def chunk_length(index: int) -> int:
+        return min(COPY_CHUNK_SIZE, st.st_size - index * COPY_CHUNK_SIZE)
+
+    recorded = []
+    if track_progress:
+        try:
+            with open(progress_path, 'r', encoding='utf-8') as f:
+                progress = json.load(f)
+            if (progress["source"], progress["size"], progress["mtime_ns"], progress["chunk_size"]) == \
+                    (str(source), st.st_size, st.st_mtime_ns, COPY_CHUNK_SIZE):
+                recorded = [str(digest) for digest in progress["digests"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            recorded = []
+
+    verified = False
+    src_fd = os.open(source, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        dst_fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            # 续传：临时文件中与记录的摘要一致的前缀才保留
+            digests = []
+            for expected in recorded:
+                index = len(digests)
+                if index * COPY_CHUNK_SIZE >= st.st_size or \
+                        _chunk_digest(dst_fd, index * COPY_CHUNK_SIZE, chunk_length(index)) != expected:
+                    break
+                digests.append(expected)
+            offset = min(len(digests) * COPY_CHUNK_SIZE, st.st_size)
+            os.ftruncate(dst_fd, offset)
+
+            while offset < st.st_size:
+                chunk_start = offset
+                chunk_end = min(offset + COPY_CHUNK_SIZE, st.st_size)
+                while offset < chunk_end:
+                    copied = _copy_some(src_fd, dst_fd, offset, chunk_end - offset)
+                    if copied == 0:
+                        raise OSError(errno.EIO, "源文件在复制过程中变短", str(source))
+                    offset += copied
+                os.fsync(dst_fd)
+                digests.append(_chunk_digest(dst_fd, chunk_start, chunk_end - chunk_start))
+                if track_progress:
+                    with open(progress_path, 'w', encoding='utf-8') as f:
+                        json.dump({"source": str(source), "size": st.st_size,
+                                   "mtime_ns": st.st_mtime_ns, "chunk_size": COPY_CHUNK_SIZE,
+                                   "digests": digests}, f)
+
+            # 校验：源文件复制期间未被修改，临时文件大小一致，逐块内容与源文件一致
+            current = os.stat(source)
+            verified = (current.st_size, current.st_mtime_ns) == (st.st_size, st.st_mtime_ns) and \
+                os.fstat(dst_fd).st_size == st.st_size and \
+                all(_chunk_digest(src_fd, index * COPY_CHUNK_SIZE, chunk_length(index)) == digest
+                    for index, digest in enumerate(digests))
+        finally:
+            os.close(dst_fd)
+    except BaseException:
+        # 没有进度记录的临时文件无法续传，不在分类文件夹中留下隐藏的残留文件
+        if not track_progress:
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+        raise
+    finally:
+        os.close(src_fd)
+
+    if not verified:
+        for path in (tmp_path, progress_path):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        raise OSError(errno.EIO, "复制校验失败", str(source))
+
+    shutil.copystat(str(source), str(tmp_path))
+    os.replace(tmp_path, dest)
+    try:
+        progress_path.unlink()
+    except OSError:
+        pass
+
+
+def sweep_stale_copies(folder: Path, names: Optional[List[str]] = None) -> List[str]:
+    """删除 folder 中已无法续传的跨设备复制残留（.organize-*.tmp / .progress），返回其余文件名
+
+    进度记录中的源文件已不存在即为残留；没有可读进度记录的（小文件复制被强制中断）
+    超过 STALE_COPY_SECONDS 未修改才视为残留，以免误删其他进程正在进行的复制。
+    names 为已列出的目录内容，省略时列出 folder。
+    """
+    if names is None:
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            return []
+    leftovers = {name for name in names
+                 if name.startswith(".organize-") and name.endswith((".tmp", ".progress"))}
+    if not leftovers:
+        return names
+
+    removed = set()
+    now = time.time()
+    for key in {name[len(".organize-"):].rsplit(".", 1)[0] for name in leftovers}:
+        pair = [name for name in (f".organize-{key}.tmp", f".organize-{key}.progress") if name in leftovers]
+        source_exists = None
+        if f".organize-{key}.progress" in leftovers:
+            try:
+                with open(folder / f".organize-{key}.progress", 'r', encoding='utf-8') as f:
+                    source_exists = os.path.lexists(json.load(f)["source"])
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        if source_exists is None:
+            try:
+                stale = now - max(os.lstat(folder / name).st_mtime for name in pair) > STALE_COPY_SECONDS
+            except OSError:
+                continue
+        else:
+            stale = not source_exists
+        if not stale:
+            continue
+        for name in pair:
+            try:
+                (folder / name).unlink()
+                removed.add(name)
+            except OSError:
+                pass
+    return [name for name in names if name not in removed]
+
+
+def move_across_devices(source: Path, dest: Path):
+    """跨设备移动：复制并校验成功后才删除源文件"""
+    if source.is_symlink():
+        # 符号链接按 shutil.move 的方式重建链接本身
+        shutil.move(str(source), str(dest))
+        return
+    copy_file_resumable(source, dest)
+    source.unlink()
+
+
+def ensure_folder(folder: Path, known_dirs: set):
+    """确保目录存在；known_dirs 记录本次运行中已确认存在的目录，避免重复 mkdir"""
+    if folder in known_dirs:
+        return
+    if folder.parent in known_dirs:
+        # 父目录已存在，一次 mkdir 即可，无需逐级检查上级目录
+        try:
+            folder.mkdir(exist_ok=True)
+        except FileNotFoundError:
+            # 父目录已被删除（如撤销时清理了空文件夹），缓存过期，逐级重新创建
+            known_dirs.clear()
+            folder.mkdir(parents=True, exist_ok=True)
+            known_dirs.update(folder.parents)
+    else:
+        folder.mkdir(parents=True, exist_ok=True)
+        known_dirs.update(folder.parents)
+    known_dirs.add(folder)
+
+
+def create_dest_folders(moves: List[PlannedMove], known_dirs: set):
+    """移动开始前一次性创建计划中所有不同的目标目录（上级目录优先）"""
+    folders = {f.dest_dir: f.dest_folder for f in moves}.values()
+    for folder in sorted(folders, key=lambda p: len(p.parts)):
+        try:
+            ensure_folder(folder, known_dirs)
+        except OSError:
+            # 无法创建的目录留给对应文件的移动去报告失败
+            continue
+        sweep_stale_copies(folder)
+
+
+def move_file(source: Path, dest: Path, same_device: bool = False):
+    """移动单个文件（目标目录需已存在）
+
+    same_device 为 True 时直接 os.rename；若实际跨设备（如分类文件夹是挂载点）
+    则退回可续传的跨设备复制。
+    """
+    if same_device:
+        try:
+            os.rename(str(source), str(dest))
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    move_across_devices(source, dest)
+
+
+def get_device(path: Path) -> Optional[int]:
+    """返回 path（或其最近的已存在上级目录）所在设备号"""
+    for candidate in [path, *path.parents]:
+        try:
+            return os.stat(candidate).st_dev
+        except FileNotFoundError:
+            continue
+        except OSError:
+            return None
+    return None
+
+
+def execute_moves(moves: List[PlannedMove], workers: int = 1):
+    """执行移动计划，产出 (计划项, 异常或 None)
+
+    先执行同设备的重命名（瞬间完成），再执行跨设备的复制。
+    workers > 1 时并行执行：重命名和复制分别放入独立的线程池，
+    大文件复制不会阻塞后面的小文件。结果按完成顺序产出。
+    """
+    renames = [f for f in moves if f.same_device]
+    copies = [f for f in moves if not f.same_device]
+    create_dest_folders(moves, set())
+
+    def run(f: PlannedMove):
+        try:
+            move_file(f.source, f.dest, f.same_device)
+        except Exception as e:
+            return f, e
+        return f, None
+
+    if workers <= 1:
+        for f in renames + copies:
+            yield run(f)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    with ThreadPoolExecutor(max_workers=workers) as rename_pool, \
+            ThreadPoolExecutor(max_workers=workers) as copy_pool:
+        futures = [rename_pool.submit(run, f) for f in renames]
+        futures += [copy_pool.submit(run, f) for f in copies]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def execute_moves_streaming(moves: Iterable[PlannedMove], workers: int = 1):
+    """按计划产出的顺序边规划边移动，产出 (计划项, 异常或 None)
+
+    目标目录在移动前按需创建。workers > 1 时重命名与复制各用一个线程池，
+    同时在途的移动不超过 workers * 4 个（限制内存占用），结果按完成顺序产出。
+    """
+    known_dirs = set()
+
+    def run(f: PlannedMove):
+        try:
+            if f.dest_folder not in known_dirs:
+                ensure_folder(f.dest_folder, known_dirs)
+                sweep_stale_copies(f.dest_folder)
+            move_file(f.source, f.dest, f.same_device)
+        except Exception as e:
+            return f, e
+        return f, None
+
+    if workers <= 1:
+        for f in moves:
+            yield run(f)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+    max_in_flight = workers * 4
+    with ThreadPoolExecutor(max_workers=workers) as rename_pool, \
+            ThreadPoolExecutor(max_workers=workers) as copy_pool:
+        pending = set()
+        for f in moves:
+            pool = rename_pool if f.same_device else copy_pool
+            pending.add(pool.submit(run, f))
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+# ============ 重复文件检测 ============
+
+# 部分哈希读取的首尾数据块大小
+PARTIAL_HASH_BLOCK = 64 * 1024
+
+
+def hash_file(path: Path, partial: bool = False) -> str:
+    """流式计算文件的 SHA-256；partial=True 时只读取首尾各 PARTIAL_HASH_BLOCK 字节"""
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if partial:
+            digest.update(f.read(PARTIAL_HASH_BLOCK))
+            size = os.fstat(f.fileno()).st_size
+            if size > PARTIAL_HASH_BLOCK:
+                f.seek(max(PARTIAL_HASH_BLOCK, size - PARTIAL_HASH_BLOCK))
+                digest.update(f.read(PARTIAL_HASH_BLOCK))
+        else:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_hash_cache_path() -> Path:
+    """文件哈希缓存路径（与 HISTORY_FILE 同目录）"""
+    return HISTORY_FILE.parent / "hash_cache.json"
 
-    base = dest_path.stem
-    ext = dest_path.suffix
-    parent = dest_path.parent
-    counter = 1
 
-    while True:
-        new_name = f"{base}_{counter}{ext}"
-        new_path = parent / new_name
-        if not new_path.exists():
-            return new_path
-        counter += 1
+class HashCache:
+    """持久化的文件哈希缓存（LRU，条目数上限 max_entries）
 
+    以 (设备, inode, 大小, mtime_ns) 为键：内容未变的文件不必重新读取；
+    同一文件系统内的移动（重命名）保持 inode 不变，缓存在整理后依然有效。
+    """
 
-def format_size(size: int) -> str:
-    """格式化文件大小"""
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if size < 1024:
-            return f"{size:.1f}{unit}"
-        size /= 1024
-    return f"{size:.1f}TB"
+    VERSION = 1
 
+    def __init__(self, path: Path, max_entries: int = HASH_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                # 文件中按最久未使用 → 最近使用的顺序保存
+                for key, hashes in data["entries"]:
+                    self._entries[key] = hashes
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            pass
+
+    @staticmethod
+    def _key(st: os.stat_result) -> str:
+        return f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+    def get(self, st: os.stat_result, kind: str) -> Optional[str]:
+        """kind 为 "partial" 或 "full" """
+        key = self._key(st)
+        with self._lock:
+            hashes = self._entries.get(key)
+            if hashes is None or kind not in hashes:
+                return None
+            self._entries.move_to_end(key)
+            return hashes[kind]
+
+    def put(self, st: os.stat_result, kind: str, value: str):
+        key = self._key(st)
+        with self._lock:
+            hashes = self._entries.pop(key, {})
+            hashes[kind] = value
+            self._entries[key] = hashes
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".json.tmp")
+        with self._lock:
+            entries = [[key, hashes] for key, hashes in self._entries.items()]
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": self.VERSION, "entries": entries}, f)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+class DuplicateFinder:
+    """规划阶段的重复文件检测
+
+    对每个目标文件夹，先按文件大小分组（已有文件 + 本次计划移入的文件），
+    大小相同才比较首尾部分哈希，部分哈希仍相同才计算完整哈希。
+    同一组的哈希可在线程池中并行计算；传入 hash_cache 时未变化的文件不再重新读取。
+
+    计划移入的文件以源路径登记，plan_move 记下它的目标路径，报告重复时显示目标路径。
+    流式整理时传入 max_entries：登记的文件总数超出后淘汰最久未用的目标文件夹，
+    再用到时重新列出（已移入的文件届时已在目录中）。边规划边移动时，
+    用 start_move / finish_move 告知移动的开始和结束，比较时按源或目标路径读取。
+    """
 
-def build_dest_path(filename: str, file_path: Path, target_root: Path) -> Tuple[Path, str]:
-    """计算文件的目标路径和显示分类名
+    def __init__(self, workers: int = 1, hash_cache: Optional[HashCache] = None,
+                 max_entries: Optional[int] = None):
+        self.duplicates: List[Tuple[Path, Path]] = []  # (待移动文件, 目标中内容相同的文件)
+        self._sizes: "OrderedDict[Path, Dict[int, List[Path]]]" = OrderedDict()
+        self._stats: Dict[Path, os.stat_result] = {}
+        self._hashes: Dict[Tuple[Path, bool], str] = {}
+        self._hash_cache = hash_cache
+        self._max_entries = max_entries
+        self._entries = 0  # _sizes 中登记的文件总数
+        # 计划移入的文件：源路径 → 计划的目标路径
+        self._planned: Dict[Path, Path] = {}
+        # 在途的移动：源路径 → (目标路径, stat)；文件总在两者之一
+        self._moving: Dict[Path, Tuple[Path, os.stat_result]] = {}
+        self._pool = None
+        if workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def _files_by_size(self, folder: Path) -> Dict[int, List[Path]]:
+        by_size = self._sizes.get(folder)
+        if by_size is not None:
+            if self._max_entries is not None:
+                self._sizes.move_to_end(folder)
+            return by_size
+
+        by_size = defaultdict(list)
+        for entry in scan_directory(str(folder)):
+            try:
+                if entry.is_file() and not should_skip(entry.name):
+                    path = Path(entry.path)
+                    self._stats[path] = entry.stat()
+                    by_size[self._stats[path].st_size].append(path)
+                    self._entries += 1
+            except OSError:
+                continue
+        # 正在移入该文件夹、尚未落地的文件
+        for source, (dest, st) in self._moving.items():
+            if st.st_size and dest.parent == folder and dest not in by_size[st.st_size]:
+                self._stats[source] = st
+                by_size[st.st_size].append(source)
+                self._entries += 1
+        self._sizes[folder] = by_size
+        self._evict()
+        return by_size
+
+    def _forget(self, path: Path):
+        self._stats.pop(path, None)
+        self._hashes.pop((path, True), None)
+        self._hashes.pop((path, False), None)
+        self._planned.pop(path, None)
+
+    def _evict(self):
+        """登记的文件总数超出 max_entries 时淘汰最久未用的文件夹（保留最近用到的一个）"""
+        if self._max_entries is None:
+            return
+        while self._entries > self._max_entries and len(self._sizes) > 1:
+            _, by_size = self._sizes.popitem(last=False)
+            for paths in by_size.values():
+                self._entries -= len(paths)
+                for path in paths:
+                    if path not in self._moving:
+                        self._forget(path)
+
+    def _hash(self, path: Path, partial: bool) -> Optional[str]:
+        key = (path, partial)
+        if key not in self._hashes:
+            st = self._stats.get(path)
+            kind = "partial" if partial else "full"
+            value = None
+            if self._hash_cache is not None and st is not None:
+                value = self._hash_cache.get(st, kind)
+            if value is None:
+                # 在途的文件先读源路径，已被移走时再读目标路径
+                moving = self._moving.get(path)
+                for candidate in (path,) if moving is None else (path, moving[0]):
+                    try:
+                        value = hash_file(candidate, partial)
+                    except OSError:
+                        continue
+                    if self._hash_cache is not None and st is not None:
+                        self._hash_cache.put(st, kind, value)
+                    break
+            self._hashes[key] = value
+        return self._hashes[key]
+
+    def _hash_all(self, paths: List[Path], partial: bool) -> List[Optional[str]]:
+        if self._pool is None or len(paths) < 2:
+            return [self._hash(path, partial) for path in paths]
+        return list(self._pool.map(lambda path: self._hash(path, partial), paths))
+
+    def find_duplicate(self, file_path: Path, st: os.stat_result, dest_folder: Path) -> Optional[Path]:
+        """返回目标文件夹中与 file_path 内容相同的文件；没有则把它登记为计划移入的文件"""
+        self._stats[file_path] = st
+        by_size = self._files_by_size(dest_folder)
+        same_size = by_size.get(st.st_size, []) if st.st_size else []
+
+        candidates = same_size
+        # 文件不超过首尾两块时，部分哈希已覆盖全部内容
+        stages = [True] if st.st_size <= 2 * PARTIAL_HASH_BLOCK else [True, False]
+        for partial in stages:
+            if not candidates:
+                break
+            hashes = self._hash_all([file_path] + candidates, partial)
+            if hashes[0] is None:
+                candidates = []
+                break
+            candidates = [path for path, h in zip(candidates, hashes[1:]) if h == hashes[0]]
+
+        if candidates:
+            existing = self._planned.get(candidates[0], candidates[0])
+            self.duplicates.append((file_path, existing))
+            self._forget(file_path)
+            return existing
+
+        if st.st_size:
+            by_size[st.st_size].append(file_path)
+            self._entries += 1
+            self._evict()
+        else:
+            self._forget(file_path)
+        return None
 
-    Returns:
-        (dest_folder, display_category)
-    """
-    category = get_category(filename)
-    subcategory = get_smart_subcategory(filename, category)
-    date_folder = get_date_folder(file_path) if ARCHIVE_BY_DATE else None
+    def plan_move(self, source: Path, dest: Path):
+        """记下计划移入文件的目标路径（find_duplicate 返回 None 且分配好文件名之后调用）"""
+        if source in self._stats:
+            self._planned[source] = dest
+
+    def start_move(self, source: Path):
+        """登记即将开始的移动（提交移动之前调用）"""
+        dest = self._planned.get(source)
+        if dest is not None:
+            self._moving[source] = (dest, self._stats[source])
+
+    def finish_move(self, source: Path, moved: bool):
+        """移动结束后调用：成功时把登记的源路径换成目标路径"""
+        dest, st = self._moving.pop(source, (None, None))
+        self._planned.pop(source, None)
+        if dest is None or not moved:
+            return
+        by_size = self._sizes.get(dest.parent)
+        paths = by_size.get(st.st_size) if by_size is not None else None
+        if paths is None or source not in paths:
+            self._forget(source)
+            return
+        paths[paths.index(source)] = dest
+        self._stats[dest] = self._stats.pop(source, st)
+        for partial in (True, False):
+            if (source, partial) in self._hashes:
+                self._hashes[(dest, partial)] = self._hashes.pop((source, partial))
+
+
+# ============ 性能统计 ============
+
+# 统计的热路径：(显示名称, 函数所在对象, 函数名)；对象为 None 表示本模块
+STATS_TARGETS = [
+    ("列目录 scan_directory", None, "scan_directory"),
+    ("跳过判断 should_skip", None, "should_skip"),
+    ("分类 build_dest_path", None, "build_dest_path"),
+    ("重名处理 get_unique_path", None, "get_unique_path"),
+    ("移动 move_file", None, "move_file"),
+    ("移动 shutil.move", shutil, "move"),
+    ("历史 start_new_batch", None, "start_new_batch"),
+    ("历史 add_to_batch", None, "add_to_batch"),
+    ("历史 record_move", None, "record_move"),
+    ("历史 sync_history", None, "sync_history"),
+    ("历史 remove_batch", None, "remove_batch"),
+]
 
-    if subcategory and date_folder:
-        dest_folder = target_root / category / subcategory / date_folder
-    elif subcategory:
-        dest_folder = target_root / category / subcategory
-    elif date_folder:
-        dest_folder = target_root / category / date_folder
-    else:
-        dest_folder = target_root / category
 
-    display_category = f"{category}/{subcategory}" if subcategory else category
-    return dest_folder, display_category
+class HotPathStats:
+    """热路径的调用计数与累计耗时（--stats）
 
+    install() 把 STATS_TARGETS 中的函数替换为计时包装，uninstall() 恢复原函数。
+    未启用时不做任何替换，热路径没有额外开销。
+    """
 
-def is_in_organized_folder(file_path: Path, target_root: Path) -> bool:
-    """检查文件是否已在目标根目录的已整理子文件夹中"""
-    try:
-        rel = file_path.relative_to(target_root)
-        if len(rel.parts) > 1 and rel.parts[0] in ORGANIZED_FOLDER_NAMES:
-            return True
-    except ValueError:
-        pass
-    return False
+    def __init__(self):
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()  # 扫描/移动线程池中的调用也会计入
+        self._originals = []
 
+    def _wrap(self, name: str, func):
+        calls, seconds, lock = self.calls, self.seconds, self._lock
+        perf_counter = time.perf_counter
 
-# ============ 历史记录管理 ============
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                with lock:
+                    calls[name] += 1
+                    seconds[name] += elapsed
+
+        timed.__wrapped__ = func
+        return timed
+
+    def install(self):
+        module = sys.modules[__name__]
+        for name, owner, attr in STATS_TARGETS:
+            owner = owner if owner is not None else module
+            func = getattr(owner, attr)
+            self._originals.append((owner, attr, func))
+            setattr(owner, attr, self._wrap(name, func))
+
+    def uninstall(self):
+        for owner, attr, func in reversed(self._originals):
+            setattr(owner, attr, func)
+        self._originals.clear()
+
+    def total_calls(self) -> int:
+        with self._lock:
+            return sum(self.calls.values())
+
+    def print_report(self, title: str = "性能统计"):
+        elapsed = time.perf_counter() - self.started
+        with self._lock:
+            rows = [(name, self.calls[name], self.seconds[name])
+                    for name, _, _ in STATS_TARGETS if self.calls.get(name)]
+        print(f"\n📊 {title}（运行 {elapsed:.2f} 秒）")
+        if not rows:
+            print("   （无调用）")
+            return
+        print(f"   {'调用次数':>8}  {'总耗时(ms)':>10}  {'平均(us)':>8}  环节")
+        for name, calls, seconds in rows:
+            print(f"   {calls:>12}  {seconds * 1000:>13.1f}  {seconds / calls * 1e6:>10.1f}  {name}")
 
-def migrate_history_if_needed():
-    """从旧位置迁移历史记录到新的集中位置"""
-    old_history = Path.home() / "Downloads" / ".organize_history.json"
-    if old_history.exists() and not HISTORY_FILE.exists():
-        HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(str(old_history), str(HISTORY_FILE))
 
+_hot_path_stats: Optional[HotPathStats] = None
 
-def load_history() -> List[Dict]:
-    """加载移动历史"""
-    if not HISTORY_FILE.exists():
-        return []
-    try:
-        with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return []
 
+def enable_stats():
+    """开始收集热路径统计"""
+    global _hot_path_stats
+    if _hot_path_stats is None:
+        _hot_path_stats = HotPathStats()
+        _hot_path_stats.install()
 
-def save_history(history: List[Dict]):
-    """保存移动历史"""
-    HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-        json.dump(history, f, ensure_ascii=False, indent=2)
 
+def print_stats(title: str = "性能统计"):
+    """输出已收集的统计（未启用时不输出）"""
+    if _hot_path_stats is not None:
+        _hot_path_stats.print_report(title)
 
-def record_move(source: Path, dest: Path):
-    """记录一次移动操作"""
-    history = load_history()
-
-    # 获取最新的批次ID
-    batch_id = history[-1]["batch_id"] if history and "batch_id" in history[-1] else 0
-    current_batch = history[-1] if history and history[-1].get("batch_id") == batch_id else None
-
-    if current_batch and (datetime.now() - datetime.fromisoformat(current_batch["timestamp"])).seconds < 60:
-        # 同一批次（60秒内）
-        current_batch["moves"].append({
-            "source": str(source),
-            "dest": str(dest)
-        })
-    else:
-        # 新批次
-        history.append({
-            "batch_id": batch_id + 1,
-            "timestamp": datetime.now().isoformat(),
-            "moves": [{
-                "source": str(source),
-                "dest": str(dest)
-            }]
-        })
 
-    save_history(history)
+# ============ 性能分析 ============
 
+class SamplingProfiler:
+    """轻量采样分析器（用于长时间运行的监控模式）
 
-def start_new_batch():
-    """开始新的操作批次"""
-    history = load_history()
-    batch_id = history[-1]["batch_id"] + 1 if history else 1
-    history.append({
-        "batch_id": batch_id,
-        "timestamp": datetime.now().isoformat(),
-        "moves": []
-    })
-    save_history(history)
-    return batch_id
+    后台线程每隔 interval 秒采集一次所有其他线程的调用栈，按函数累计
+    自身/累计采样数，结果以 pstats 兼容格式保存，可用 pstats 或 snakeviz 查看。
+    开销与调用次数无关，不像 cProfile 那样拖慢观察者线程。
+    """
 
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.ticks = 0
+        self.elapsed = 0.0
+        self._self_counts: Dict[Tuple, int] = defaultdict(int)
+        self._total_counts: Dict[Tuple, int] = defaultdict(int)
+        self._callers: Dict[Tuple, Dict[Tuple, int]] = defaultdict(lambda: defaultdict(int))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self._started
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.ticks += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self._sample(frame)
+
+    def _sample(self, frame):
+        callee = None
+        seen = set()
+        while frame is not None:
+            code = frame.f_code
+            func = (code.co_filename, code.co_firstlineno, code.co_name)
+            if callee is None:
+                self._self_counts[func] += 1
+            else:
+                self._callers[callee][func] += 1
+            # 递归调用在同一个栈中只计一次累计采样
+            if func not in seen:
+                seen.add(func)
+                self._total_counts[func] += 1
+            callee = func
+            frame = frame.f_back
+
+    def dump_stats(self, path: Path):
+        """按 cProfile 的格式写出 {函数: (原始调用数, 调用数, 自身耗时, 累计耗时, 调用者)}"""
+        import marshal
+
+        # 实际的采样间隔（含调度延迟）
+        tick = self.elapsed / self.ticks if self.ticks else self.interval
+        stats = {}
+        for func, total in self._total_counts.items():
+            callers = {
+                caller: (count, count, 0.0, count * tick)
+                for caller, count in self._callers[func].items()
+            }
+            stats[func] = (total, total, self._self_counts[func] * tick, total * tick, callers)
+        with open(path, 'wb') as f:
+            marshal.dump(stats, f)
+
+
+def write_profile_summary(pstats_path: Path, summary_path: Path,
+                          top: int = PROFILE_TOP) -> Tuple[str, str]:
+    """把热点函数摘要写入文本文件，返回 (按自身耗时排序的部分, 按累计耗时排序的部分)"""
+    import io
+    import pstats
+
+    sections = []
+    for sort_key, title in (("tottime", "按自身耗时排序"), ("cumulative", "按累计耗时排序")):
+        out = io.StringIO()
+        out.write(f"{title}（前 {top} 个）\n")
+        stats = pstats.Stats(str(pstats_path), stream=out)
+        stats.strip_dirs()
+        stats.sort_stats(sort_key).print_stats(top)
+        sections.append(out.getvalue())
+    summary_path.write_text("".join(sections), encoding="utf-8")
+    return sections[0], sections[1]
+
+
+def run_profiled(command: str, func, sampling: bool = False):
+    """在分析器下运行命令，.pstats 和热点摘要写入 HISTORY_FILE 所在目录
+
+    sampling 为 True 时使用 SamplingProfiler（覆盖所有线程），否则使用 cProfile。
+    """
+    profile_dir = HISTORY_FILE.parent
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    stem = f"profile-{command}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    pstats_path = profile_dir / f"{stem}.pstats"
+    summary_path = profile_dir / f"{stem}.txt"
+
+    if sampling:
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            func()
+        finally:
+            profiler.stop()
+            profiler.dump_stats(pstats_path)
+    else:
+        import cProfile
 
-def add_to_batch(source: Path, dest: Path):
-    """添加移动记录到当前批次"""
-    history = load_history()
-    if history:
-        history[-1]["moves"].append({
-            "source": str(source),
-            "dest": str(dest)
-        })
-        save_history(history)
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(func)
+        finally:
+            profiler.dump_stats(str(pstats_path))
+
+    by_tottime, _ = write_profile_summary(pstats_path, summary_path)
+    # 终端只显示按自身耗时排序的部分
+    print("\n" + by_tottime.rstrip())
+    print(f"\n🔬 性能分析结果: {pstats_path}")
+    print(f"   热点摘要: {summary_path}")
 
 
 # ============ 主要功能 ============
 
-def calculate_moves(source_folders: Dict, target_root: Path) -> Tuple[Dict, List]:
-    """计算需要移动的文件
+def iter_planned_moves(source_folders: Dict, target_root: Path,
+                       dedupe: Optional[DuplicateFinder] = None, on_skip=None,
+                       dest_index: Optional[DestinationIndex] = None):
+    """边扫描边规划，按扫描顺序逐个产出 (显示分类, PlannedMove)
 
     Args:
         source_folders: 源文件夹配置 {"name": {"path": Path, "recursive": bool}}
         target_root: 集中整理的目标根目录
+        dedupe: 传入时跳过与目标文件夹中已有文件内容相同的文件（记录在 dedupe.duplicates）
+        on_skip: 跳过隐藏文件/正在下载的文件时以文件名调用
+        dest_index: 目标文件名索引，默认 DestinationIndex（流式整理传入 StreamingDestinationIndex）
     """
-    stats = defaultdict(list)
-    skipped = []
+    if dest_index is None:
+        dest_index = DestinationIndex()
+    # 本次规划的目录驻留表，计划项通过 move.dirs 引用
+    dirs = DirectoryTable()
+    # 与目标根目录同设备的文件只需重命名，否则需要跨设备复制
+    target_device = get_device(target_root)
 
-    def process_file(file_path: Path, source_name: str):
-        """处理单个文件"""
-        filename = file_path.name
+    def plan_file(entry: os.DirEntry, source_name: str) -> Optional[Tuple[str, PlannedMove]]:
+        """规划单个文件（整个流程只 stat 一次）"""
+        filename = entry.name
 
         if should_skip(filename):
-            skipped.append(filename)
-            return
+            if on_skip is not None:
+                on_skip(filename)
+            return None
+
+        file_path = Path(entry.path)
 
         # 跳过已在目标根目录的已整理子文件夹中的文件
         if is_in_organized_folder(file_path, target_root):
-            return
+            return None
+
+        try:
+            st = entry.stat()
+        except OSError:
+            return None
 
         # 使用共享辅助函数计算目标路径
-        dest_folder, display_category = build_dest_path(filename, file_path, target_root)
-        dest_path = dest_folder / filename
+        dest_folder, display_category = build_dest_path(filename, file_path, target_root, st)
+        source_dir = dirs.intern(os.path.dirname(entry.path))
+        dest_dir = dirs.intern(dest_folder)
+
+        # 如果文件已经在正确位置，跳过（目录 ID 相同即同一目录）；
+        # 去重模式：目标文件夹中已有相同内容的文件，跳过
+        if source_dir == dest_dir or (
+                dedupe is not None and dedupe.find_duplicate(file_path, st, dest_folder) is not None):
+            dirs.release(source_dir)
+            dirs.release(dest_dir)
+            return None
+
+        dest_path = get_unique_path(dest_folder / filename, dest_index)
+        if dedupe is not None:
+            dedupe.plan_move(file_path, dest_path)
+
+        # 日期文件夹只有几十种，驻留后所有计划项共享同一个字符串
+        date_folder = sys.intern(get_date_folder(file_path, st)) if ARCHIVE_BY_DATE else None
+        # 没有重名时目标文件名就是源文件名，共用同一个字符串
+        dest_name = dest_path.name
+        if dest_name == filename:
+            dest_name = filename
+
+        return display_category, PlannedMove(
+            dirs=dirs,
+            source_dir=source_dir,
+            source_name=filename,
+            dest_dir=dest_dir,
+            dest_name=dest_name,
+            size=st.st_size,
+            date_folder=date_folder,
+            source_folder=source_name,
+            same_device=st.st_dev == target_device,
+        )
 
-        # 如果文件已经在正确位置，跳过
-        if file_path.parent == dest_folder:
-            return
+    scan_index = ScanIndex(get_scan_index_path()) if INCREMENTAL_SCAN else None
+    scanned_roots = []
+    pool = None
+    if SCAN_WORKERS > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(max_workers=SCAN_WORKERS)
+    try:
+        for source_name, config in source_folders.items():
+            source_path = config["path"]
+            if not source_path.exists():
+                continue
+            scanned_roots.append(source_path)
+            for entry in iter_source_files(source_path, config["recursive"], target_root, pool, scan_index):
+                planned = plan_file(entry, source_name)
+                if planned is not None:
+                    yield planned
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    # 只有完整扫描后才保存索引
+    if scan_index is not None:
+        try:
+            scan_index.save(scanned_roots)
+        except OSError as e:
+            print(f"   ⚠️ 无法保存扫描索引: {e}")
 
-        dest_path = get_unique_path(dest_path)
 
-        try:
-            file_size = file_path.stat().st_size
-        except OSError:
-            return
+def calculate_moves(source_folders: Dict, target_root: Path,
+                    dedupe: Optional[DuplicateFinder] = None) -> Tuple[Dict, List]:
+    """计算需要移动的文件，返回 ({显示分类: [PlannedMove]}, 跳过的文件名)
 
-        date_folder = get_date_folder(file_path) if ARCHIVE_BY_DATE else None
+    参数同 iter_planned_moves。
+    """
+    stats = defaultdict(list)
+    skipped = []
+    for display_category, move in iter_planned_moves(source_folders, target_root, dedupe, skipped.append):
+        stats[display_category].append(move)
+    return stats, skipped
 
-        stats[display_category].append({
-            "source": file_path,
-            "dest": dest_path,
-            "size": file_size,
-            "date_folder": date_folder,
-            "source_folder": source_name,
-        })
 
-    def scan_directory(dir_path: Path, source_name: str, recursive: bool, depth: int = 0):
-        """扫描目录"""
-        try:
-            items = list(dir_path.iterdir())
-        except PermissionError:
-            return
+class PlanSummary:
+    """流式整理的汇总统计：只累计各分类的数量和大小，每个分类保留少量示例"""
 
-        for item in items:
-            if item.is_file():
-                process_file(item, source_name)
-            elif item.is_dir() and recursive:
-                # 跳过隐藏文件夹和.app包
-                if item.name.startswith(".") or item.name.endswith(".app"):
-                    continue
-                # 当源文件夹就是目标根目录时，跳过已整理的分类文件夹
-                if dir_path == target_root and item.name in ORGANIZED_FOLDER_NAMES:
-                    continue
-                scan_directory(item, source_name, recursive, depth + 1)
+    EXAMPLES = 5
 
-    for source_name, config in source_folders.items():
-        source_path = config["path"]
-        if not source_path.exists():
-            continue
-        scan_directory(source_path, source_name, recursive=config["recursive"])
+    def __init__(self):
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.sizes: Dict[str, int] = defaultdict(int)
+        self.dates: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.examples: Dict[str, List[str]] = defaultdict(list)
+        self.copy_files = 0
+        self.copy_size = 0
+        self.skipped = 0
 
-    return stats, skipped
+    def add(self, category: str, move: PlannedMove):
+        self.counts[category] += 1
+        self.sizes[category] += move.size
+        if move.date_folder is not None:
+            self.dates[category][move.date_folder] += 1
+        examples = self.examples[category]
+        if len(examples) < self.EXAMPLES:
+            examples.append(f"[{move.source_folder}] {move.source_name}")
+        if not move.same_device:
+            self.copy_files += 1
+            self.copy_size += move.size
+
+    def skip(self, filename: str):
+        self.skipped += 1
 
 
 def print_preview(stats: Dict, skipped: List, source_folders: Dict, target_root: Path, dry_run: bool = True):
@@ -416,12 +2383,18 @@ def print_preview(stats: Dict, skipped: List, source_folders: Dict, target_root:
 
     total_files = 0
     total_size = 0
+    copy_files = 0
+    copy_size = 0
 
     for category, files in sorted(stats.items()):
         count = len(files)
-        size = sum(f["size"] for f in files)
+        size = sum(f.size for f in files)
         total_files += count
         total_size += size
+        for f in files:
+            if not f.same_device:
+                copy_files += 1
+                copy_size += f.size
 
         print(f"\n📁 {category}/ ({count}个文件, {format_size(size)})")
 
@@ -429,39 +2402,102 @@ def print_preview(stats: Dict, skipped: List, source_folders: Dict, target_root:
         if ARCHIVE_BY_DATE:
             by_date = defaultdict(list)
             for f in files:
-                by_date[f["date_folder"]].append(f)
+                by_date[f.date_folder].append(f)
 
             for date_folder in sorted(by_date.keys(), reverse=True):
                 date_files = by_date[date_folder]
                 print(f"   📆 {date_folder}/ ({len(date_files)}个)")
                 for f in date_files[:3]:
-                    origin = f.get("source_folder", "")
-                    print(f"      └─ [{origin}] {f['source'].name}")
+                    print(f"      └─ [{f.source_folder}] {f.source_name}")
                 if len(date_files) > 3:
                     print(f"      └─ ... 还有{len(date_files)-3}个文件")
         else:
             for f in files[:5]:
-                origin = f.get("source_folder", "")
-                print(f"   └─ [{origin}] {f['source'].name}")
+                print(f"   └─ [{f.source_folder}] {f.source_name}")
             if len(files) > 5:
                 print(f"   └─ ... 还有{len(files)-5}个文件")
 
     print(f"\n" + "-"*60)
     print(f"总计: {total_files}个文件, {format_size(total_size)}")
+    if copy_files:
+        print(f"跨设备复制: {copy_files}个文件, {format_size(copy_size)}（其余为同设备重命名）")
 
     if skipped:
         print(f"跳过: {len(skipped)}个文件 (隐藏文件/正在下载)")
 
 
+def print_summary(summary: PlanSummary, source_folders: Dict, target_root: Path, dry_run: bool = True):
+    """打印流式整理的汇总（格式与 print_preview 相同，示例文件数有限）"""
+    print("\n" + "="*60)
+    print(f"{'📋 预览模式' if dry_run else '🚀 执行模式'}（流式）")
+    print(f"📂 目标文件夹: {target_root}")
+    print(f"📥 扫描来源: {', '.join(source_folders.keys())}")
+    if ARCHIVE_BY_DATE:
+        print(f"📅 按日期归档已启用")
+    print("="*60)
+
+    for category in sorted(summary.counts):
+        count = summary.counts[category]
+        print(f"\n📁 {category}/ ({count}个文件, {format_size(summary.sizes[category])})")
+        if ARCHIVE_BY_DATE:
+            for date_folder, date_count in sorted(summary.dates[category].items(), reverse=True):
+                print(f"   📆 {date_folder}/ ({date_count}个)")
+        else:
+            for example in summary.examples[category]:
+                print(f"   └─ {example}")
+            if count > len(summary.examples[category]):
+                print(f"   └─ ... 还有{count - len(summary.examples[category])}个文件")
+
+    print(f"\n" + "-"*60)
+    print(f"总计: {sum(summary.counts.values())}个文件, {format_size(sum(summary.sizes.values()))}")
+    if summary.copy_files:
+        print(f"跨设备复制: {summary.copy_files}个文件, {format_size(summary.copy_size)}（其余为同设备重命名）")
+
+    if summary.skipped:
+        print(f"跳过: {summary.skipped}个文件 (隐藏文件/正在下载)")
+
+
+def print_duplicates(duplicates: List[Tuple[Path, Path]], target_root: Path):
+    """打印去重模式发现的重复文件"""
+    if not duplicates:
+        return
+    print(f"重复: {len(duplicates)}个文件与目标文件夹中已有文件内容相同，保留在原处")
+    for source, existing in duplicates[:5]:
+        try:
+            existing = existing.relative_to(target_root)
+        except ValueError:
+            pass
+        print(f"   └─ {source} = {existing}")
+    if len(duplicates) > 5:
+        print(f"   └─ ... 还有{len(duplicates)-5}个文件")
+
+
 def organize_files(source_folders: Dict, target_root: Path, dry_run: bool = True):
     """整理多个文件夹的文件到集中目标"""
+    if STREAM_PLAN:
+        organize_files_streaming(source_folders, target_root, dry_run)
+        return
+
     # 确保目标文件夹存在
     target_root.mkdir(parents=True, exist_ok=True)
 
-    stats, skipped = calculate_moves(source_folders, target_root)
+    hash_cache = HashCache(get_hash_cache_path()) if DEDUPE else None
+    dedupe = DuplicateFinder(SCAN_WORKERS, hash_cache) if DEDUPE else None
+    try:
+        stats, skipped = calculate_moves(source_folders, target_root, dedupe)
+    finally:
+        if dedupe is not None:
+            dedupe.close()
+            try:
+                hash_cache.save()
+            except OSError as e:
+                print(f"   ⚠️ 无法保存哈希缓存: {e}")
     print_preview(stats, skipped, source_folders, target_root, dry_run)
+    if dedupe is not None:
+        print_duplicates(dedupe.duplicates, target_root)
 
     if dry_run:
+        print_stats()
         print(f"\n💡 这是预览模式，未做任何更改")
         print(f"   执行整理请运行: python {Path(__file__).name} --execute")
         print(f"   启动监控模式: python {Path(__file__).name} --watch")
@@ -472,36 +2508,147 @@ def organize_files(source_folders: Dict, target_root: Path, dry_run: bool = True
     print(f"\n正在整理文件... (批次 #{batch_id})")
 
     moved_count = 0
-    total_files = sum(len(files) for files in stats.values())
+    moves = [f for files in stats.values() for f in files]
+    total_files = len(moves)
 
-    for category, files in stats.items():
-        for f in files:
-            try:
-                f["dest"].parent.mkdir(parents=True, exist_ok=True)
-                shutil.move(str(f["source"]), str(f["dest"]))
-                add_to_batch(f["source"], f["dest"])
-                moved_count += 1
-            except Exception as e:
-                print(f"   ❌ 移动失败: {f['source'].name} - {e}")
+    # 历史记录按完成顺序在主线程中写入
+    for f, error in execute_moves(moves, MOVE_WORKERS):
+        if error is not None:
+            print(f"   ❌ 移动失败: {f.source_name} - {error}")
+            continue
+        add_to_batch(f.source, f.dest)
+        moved_count += 1
+
+    sync_history()
 
+    print_stats()
     print(f"\n✅ 完成！成功移动 {moved_count}/{total_files} 个文件")
     print(f"   如需撤销，运行: python {Path(__file__).name} --undo")
 
 
-def undo_last_batch():
-    """撤销最后一批移动操作"""
-    history = load_history()
+def organize_files_streaming(source_folders: Dict, target_root: Path, dry_run: bool = True):
+    """流式整理：扫描到的文件立即移动，不保存完整计划
 
-    if not history:
-        print("没有可撤销的操作")
+    第一个文件不必等整个扫描结束就开始移动；内存中只有汇总统计、少量在途的计划项
+    及其文件名/目录登记（重名判断以文件系统为准），去重缓存按条目数淘汰。
+    汇总在结束后打印。
+    """
+    target_root.mkdir(parents=True, exist_ok=True)
+
+    hash_cache = HashCache(get_hash_cache_path()) if DEDUPE else None
+    dedupe = DuplicateFinder(SCAN_WORKERS, hash_cache, STREAM_DEDUPE_MAX_ENTRIES) if DEDUPE else None
+    dest_index = StreamingDestinationIndex()
+    summary = PlanSummary()
+
+    def release(move: PlannedMove):
+        """移动结束（预览时为规划完）后释放计划项占用的文件名和目录"""
+        dest_index.release(move.dest)
+        move.dirs.release(move.source_dir)
+        move.dirs.release(move.dest_dir)
+
+    def planned_moves():
+        for display_category, move in iter_planned_moves(source_folders, target_root, dedupe,
+                                                          summary.skip, dest_index):
+            summary.add(display_category, move)
+            if dry_run:
+                release(move)
+            elif dedupe is not None:
+                dedupe.start_move(move.source)
+            yield move
+
+    moved_count = 0
+    failed_count = 0
+    try:
+        if dry_run:
+            for _ in planned_moves():
+                pass
+        else:
+            batch_id = start_new_batch()
+            print(f"\n正在整理文件... (批次 #{batch_id})")
+            # 历史记录按完成顺序在主线程中写入
+            for f, error in execute_moves_streaming(planned_moves(), MOVE_WORKERS):
+                if error is not None:
+                    print(f"   ❌ 移动失败: {f.source_name} - {error}")
+                    failed_count += 1
+                else:
+                    add_to_batch(f.source, f.dest)
+                    moved_count += 1
+                if dedupe is not None:
+                    dedupe.finish_move(f.source, error is None)
+                release(f)
+            sync_history()
+    finally:
+        if dedupe is not None:
+            dedupe.close()
+            try:
+                hash_cache.save()
+            except OSError as e:
+                print(f"   ⚠️ 无法保存哈希缓存: {e}")
+
+    print_summary(summary, source_folders, target_root, dry_run)
+    if dedupe is not None:
+        print_duplicates(dedupe.duplicates, target_root)
+    print_stats()
+
+    if dry_run:
+        print(f"\n💡 这是预览模式，未做任何更改")
+        print(f"   执行整理请运行: python {Path(__file__).name} --execute --stream")
         return
 
+    print(f"\n✅ 完成！成功移动 {moved_count}/{moved_count + failed_count} 个文件")
+    print(f"   如需撤销，运行: python {Path(__file__).name} --undo")
+
+
+def restore_move(move: Dict, known_dirs: set) -> Tuple[str, Optional[Exception]]:
+    """把一条移动记录还原回源位置，返回 ("restored" | "missing" | "failed", 异常)"""
+    source = Path(move["source"])
+    dest = Path(move["dest"])
+
+    if not dest.exists():
+        return "missing", None
+    try:
+        # 确保源目录存在
+        ensure_folder(source.parent, known_dirs)
+        move_file(dest, source, same_device=True)
+    except Exception as e:
+        return "failed", e
+    return "restored", None
+
+
+def restore_moves_parallel(moves: List[Dict], workers: int) -> List[Tuple[str, Optional[Exception]]]:
+    """并行还原，结果顺序与 moves 一致
+
+    按 (目标目录, 源目录) 分组，每组在一个线程中依次还原；所有源目录在开始前统一创建。
+    """
+    groups = defaultdict(list)
+    for index, move in enumerate(moves):
+        groups[(Path(move["dest"]).parent, Path(move["source"]).parent)].append(index)
+
+    known_dirs = set()
+    for folder in sorted({source_dir for _, source_dir in groups}, key=lambda p: len(p.parts)):
+        try:
+            ensure_folder(folder, known_dirs)
+        except OSError:
+            # 无法创建的目录留给对应文件的还原去报告失败
+            pass
+
+    results = [None] * len(moves)
+
+    def run(indices: List[int]):
+        for index in indices:
+            results[index] = restore_move(moves[index], known_dirs)
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run, groups.values()))
+    return results
+
+
+def undo_last_batch():
+    """撤销最后一批移动操作"""
     # 找到最后一个有效批次
-    last_batch = None
-    for batch in reversed(history):
-        if batch["moves"]:
-            last_batch = batch
-            break
+    last_batch = get_history_store().last_nonempty_batch()
 
     if not last_batch:
         print("没有可撤销的操作")
@@ -511,61 +2658,98 @@ def undo_last_batch():
     print(f"共 {len(last_batch['moves'])} 个文件")
     print("-" * 40)
 
+    moves = last_batch["moves"]
+    if MOVE_WORKERS > 1:
+        results = restore_moves_parallel(moves, MOVE_WORKERS)
+    else:
+        known_dirs = set()
+        results = (restore_move(move, known_dirs) for move in moves)
+
     restored = 0
-    for move in last_batch["moves"]:
+    touched_folders = set()
+    for move, (status, error) in zip(moves, results):
         source = Path(move["source"])
         dest = Path(move["dest"])
 
-        if dest.exists():
-            try:
-                # 确保源目录存在
-                source.parent.mkdir(parents=True, exist_ok=True)
-                shutil.move(str(dest), str(source))
-                print(f"   ✅ 还原: {source.name}")
-                restored += 1
-            except Exception as e:
-                print(f"   ❌ 还原失败: {dest.name} - {e}")
+        if status == "restored":
+            print(f"   ✅ 还原: {source.name}")
+            restored += 1
+            touched_folders.add(dest.parent)
+        elif status == "failed":
+            print(f"   ❌ 还原失败: {dest.name} - {error}")
         else:
             print(f"   ⚠️ 文件不存在: {dest}")
+            touched_folders.add(dest.parent)
 
     # 从历史中移除该批次
-    history = [b for b in history if b["batch_id"] != last_batch["batch_id"]]
-    save_history(history)
+    remove_batch(last_batch["batch_id"])
 
     print(f"\n✅ 已还原 {restored}/{len(last_batch['moves'])} 个文件")
 
-    # 清理目标文件夹中的空分类文件夹
-    cleanup_empty_folders(TARGET_ROOT)
+    # 清理本批次涉及的、已变空的分类文件夹（批次可能来自 --target 指定的其他目标目录）
+    by_root = defaultdict(set)
+    for folder in touched_folders:
+        target_root = find_target_root(folder)
+        if target_root is not None:
+            by_root[target_root].add(folder)
+    for target_root, folders in by_root.items():
+        cleanup_empty_folders(target_root, folders)
+    print_stats()
+
+
+def find_target_root(folder: Path) -> Optional[Path]:
+    """按 分类/[子分类]/[日期] 的目录结构从目标目录推出目标根目录，不符合时返回 None"""
+    name = folder.name
+    # 日期文件夹（如 2026-01）
+    if len(name) == 7 and name[4] == "-" and name[:4].isdigit() and name[5:].isdigit():
+        folder = folder.parent
+    # 子分类文件夹
+    if any(folder.name == sub for _, sub in SMART_RULES.get(folder.parent.name, [])):
+        folder = folder.parent
+    if folder.name in ORGANIZED_FOLDER_NAMES:
+        return folder.parent
+    return None
+
 
+def cleanup_empty_folders(target_root: Path, folders) -> int:
+    """清理空文件夹（仅清理已整理的分类文件夹，不删除用户自建文件夹）
 
-def cleanup_empty_folders(path: Path, depth: int = 0):
-    """清理空文件夹（仅清理已整理的分类文件夹，不删除用户自建文件夹）"""
-    try:
-        items = list(path.iterdir())
-    except PermissionError:
-        return
+    只检查 folders 中的目录及其上级目录（到分类文件夹为止），最深的先处理，
+    这样子目录删除后其上级也能随之被删除。返回删除的目录数。
+    """
+    candidates = set()
+    for folder in folders:
+        try:
+            parts = folder.relative_to(target_root).parts
+        except ValueError:
+            continue
+        # 顶层只清理分类文件夹
+        if not parts or parts[0] not in ORGANIZED_FOLDER_NAMES:
+            continue
+        for depth in range(1, len(parts) + 1):
+            candidates.add(target_root.joinpath(*parts[:depth]))
 
-    for folder in items:
-        if folder.is_dir() and folder.name not in SKIP_FILES:
-            # 顶层只清理分类文件夹
-            if depth == 0 and folder.name not in ORGANIZED_FOLDER_NAMES:
+    removed = 0
+    for folder in sorted(candidates, key=lambda p: len(p.parts), reverse=True):
+        try:
+            # 源文件已不存在的复制残留会让文件夹无法被清理，先删除
+            names = sweep_stale_copies(folder, os.listdir(folder))
+            # 检查是否为空（忽略.DS_Store）
+            if any(name != ".DS_Store" for name in names):
                 continue
-            cleanup_empty_folders(folder, depth + 1)
-            try:
-                # 检查是否为空（忽略.DS_Store）
-                contents = [f for f in folder.iterdir() if f.name != ".DS_Store"]
-                if not contents:
-                    # 删除.DS_Store和文件夹
-                    for f in folder.iterdir():
-                        f.unlink()
-                    folder.rmdir()
-            except:
-                pass
+            # 删除.DS_Store和文件夹
+            for name in names:
+                (folder / name).unlink()
+            folder.rmdir()
+            removed += 1
+        except OSError:
+            pass
+    return removed
 
 
 def show_history():
     """显示移动历史"""
-    history = load_history()
+    history = get_history_store().recent_batches(limit=10, preview=3)  # 只显示最近10批
 
     if not history:
         print("没有操作历史")
@@ -574,12 +2758,12 @@ def show_history():
     print("\n📜 操作历史")
     print("=" * 60)
 
-    for batch in reversed(history[-10:]):  # 只显示最近10批
+    for batch in history:
         timestamp = datetime.fromisoformat(batch["timestamp"]).strftime("%Y-%m-%d %H:%M:%S")
-        count = len(batch["moves"])
+        count = batch["count"]
         print(f"\n批次 #{batch['batch_id']} | {timestamp} | {count}个文件")
 
-        for move in batch["moves"][:3]:
+        for move in batch["moves"]:
             source_name = Path(move["source"]).name
             try:
                 dest_folder = Path(move["dest"]).parent.relative_to(TARGET_ROOT)
@@ -591,18 +2775,109 @@ def show_history():
             print(f"   ... 还有{count-3}个文件")
 
 
+def show_file_moves(path: Path):
+    """显示某个文件的去向（按时间顺序）"""
+    moves = find_file_moves(path)
+
+    if not moves:
+        print(f"没有找到 {path} 的移动记录")
+        return
+
+    print(f"\n🔎 {path}")
+    print("=" * 60)
+    for move in moves:
+        timestamp = datetime.fromisoformat(move["timestamp"]).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"批次 #{move['batch_id']} | {timestamp}")
+        print(f"   {move['source']} → {move['dest']}")
+
+
 # ============ 监控模式 ============
 
-class FileHandler(FileSystemEventHandler):
-    """文件系统事件处理器（支持多源文件夹 → 集中目标）"""
+class PendingScheduler:
+    """按截止时间排序的待处理文件调度器（所有 FileHandler 共享）
+
+    用最小堆保存 (截止时间, 序号, handler, 路径)。同一路径重新调度时只压入新条目，
+    旧条目出堆时发现与最新截止时间不符即丢弃，因此每次只处理到期的条目。
+    """
+
+    # 单次等待的上限（秒）：Windows 上不限时的锁等待可能无法被 Ctrl+C 打断
+    MAX_WAIT = 1.0
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines: Dict[str, float] = {}  # 路径 → 最新截止时间
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def schedule(self, handler, file_path_str: str, deadline: float):
+        """（重新）安排文件在 deadline 时处理，可从观察者线程调用"""
+        with self._cond:
+            self._deadlines[file_path_str] = deadline
+            heapq.heappush(self._heap, (deadline, next(self._counter), handler, file_path_str))
+            if self._heap[0][3] == file_path_str:
+                # 新的最早截止时间，唤醒主循环重新计算等待时长
+                self._cond.notify()
+
+    def pop_due(self, now: float) -> List[Tuple]:
+        """取出所有已到期的 (handler, 路径)"""
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, _, handler, file_path_str = heapq.heappop(self._heap)
+                if self._deadlines.get(file_path_str) == deadline:
+                    del self._deadlines[file_path_str]
+                    due.append((handler, file_path_str))
+        return due
+
+    def wait(self, timeout: Optional[float] = None):
+        """睡眠到下一个截止时间（或有更早的文件加入、或超时），最长 MAX_WAIT 秒"""
+        if timeout is None or timeout > self.MAX_WAIT:
+            timeout = self.MAX_WAIT
+        with self._cond:
+            if self._heap:
+                delay = self._heap[0][0] - time.time()
+                if delay <= 0:
+                    return
+                timeout = min(timeout, delay)
+            self._cond.wait(timeout)
+
+
+def import_watchdog_observer():
+    """按需导入 watchdog（只有监控模式需要），未安装时返回 None"""
+    try:
+        from watchdog.observers import Observer
+    except ImportError:
+        return None
+    return Observer
+
+
+class FileHandler:
+    """文件系统事件处理器（支持多源文件夹 → 集中目标）
 
-    def __init__(self, source_path: Path, target_root: Path, source_name: str, recursive: bool):
+    按 watchdog 的事件处理器约定实现 dispatch()，无需在导入时加载 watchdog。
+    """
+
+    def __init__(self, source_path: Path, target_root: Path, source_name: str, recursive: bool,
+                 scheduler: Optional[PendingScheduler] = None):
         self.source_path = source_path
         self.target_root = target_root
         self.source_name = source_name
         self.recursive = recursive
-        self.pending_files = {}  # 等待处理的文件
+        self.scheduler = scheduler if scheduler is not None else PendingScheduler()  # 等待处理的文件
         self.process_delay = 2  # 等待文件下载完成的延迟（秒）
+        self.stability_interval = 0.5  # 两次检查文件大小的间隔（秒）
+        self._snapshots = {}  # 路径 → 上次检查时的 (大小, mtime)
+        self.known_dirs = set()  # 已确认存在的目标目录
+
+    def dispatch(self, event):
+        """watchdog 观察者调用的入口，按事件类型分发"""
+        if event.event_type == "created":
+            self.on_created(event)
+        elif event.event_type == "moved":
+            self.on_moved(event)
 
     def on_created(self, event):
         if event.is_directory:
@@ -637,62 +2912,65 @@ class FileHandler(FileSystemEventHandler):
         if should_skip(filename):
             return
 
-        # 记录文件，稍后处理
-        self.pending_files[str(file_path)] = time.time()
-
-    def process_pending(self):
-        """处理等待中的文件"""
-        now = time.time()
-        to_remove = []
+        # 记录文件，稍后处理（新事件意味着文件有变化，重新确认是否下载完成）
+        self._snapshots.pop(str(file_path), None)
+        self.scheduler.schedule(self, str(file_path), time.time() + self.process_delay)
 
-        for file_path_str, timestamp in list(self.pending_files.items()):
-            if now - timestamp < self.process_delay:
-                continue
-
-            file_path = Path(file_path_str)
-            to_remove.append(file_path_str)
+    def process_due(self, file_path_str: str):
+        """处理一个到期的文件（不阻塞等待）
 
-            if not file_path.exists():
-                continue
+        检查文件是否还在被写入：第一次到期时只记录大小和修改时间，
+        stability_interval 后再次到期时比较，未变化才整理。
+        """
+        file_path = Path(file_path_str)
 
-            # 检查文件是否还在被写入
-            try:
-                size1 = file_path.stat().st_size
-                time.sleep(0.5)
-                size2 = file_path.stat().st_size
-                if size1 != size2:
-                    # 文件还在下载，重新加入队列
-                    self.pending_files[file_path_str] = now
-                    to_remove.remove(file_path_str)
-                    continue
-            except:
-                continue
+        try:
+            st = file_path.stat()
+        except OSError:
+            self._snapshots.pop(file_path_str, None)
+            return
 
-            # 处理文件
-            self._process_file(file_path)
+        snapshot = (st.st_size, st.st_mtime_ns)
+        previous = self._snapshots.pop(file_path_str, None)
+        if previous != snapshot:
+            # 首次检查或文件还在下载：记录当前状态，稍后再确认
+            self._snapshots[file_path_str] = snapshot
+            delay = self.stability_interval if previous is None else self.process_delay
+            self.scheduler.schedule(self, file_path_str, time.time() + delay)
+            return
 
-        for path in to_remove:
-            self.pending_files.pop(path, None)
+        # 处理文件
+        self._process_file(file_path, st)
 
-    def _process_file(self, file_path: Path):
+    def _process_file(self, file_path: Path, st: Optional[os.stat_result] = None):
         """整理单个文件到集中目标"""
         filename = file_path.name
 
-        # 使用共享辅助函数计算目标路径
-        dest_folder, display_category = build_dest_path(filename, file_path, self.target_root)
-        date_folder = get_date_folder(file_path) if ARCHIVE_BY_DATE else None
+        if st is None:
+            try:
+                st = file_path.stat()
+            except OSError:
+                return
 
-        dest_path = dest_folder / filename
+        # 使用共享辅助函数计算目标路径
+        dest_folder, display_category = build_dest_path(filename, file_path, self.target_root, st)
 
-        # 如果已在正确位置，跳过
-        if file_path.parent == dest_folder:
+        # 如果已在正确位置，跳过（监控模式长期运行，直接比较路径字符串，不登记目录）
+        if os.path.normcase(os.path.dirname(file_path)) == os.path.normcase(os.fspath(dest_folder)):
             return
 
-        dest_path = get_unique_path(dest_path)
+        date_folder = get_date_folder(file_path, st) if ARCHIVE_BY_DATE else None
+        dest_path = get_unique_path(dest_folder / filename)
 
         try:
-            dest_folder.mkdir(parents=True, exist_ok=True)
-            shutil.move(str(file_path), str(dest_path))
+            try:
+                ensure_folder(dest_folder, self.known_dirs)
+                shutil.move(str(file_path), str(dest_path))
+            except FileNotFoundError:
+                # 目标目录可能已被撤销操作清理，清空目录缓存、重新创建后再试一次
+                self.known_dirs.clear()
+                ensure_folder(dest_folder, self.known_dirs)
+                shutil.move(str(file_path), str(dest_path))
             record_move(file_path, dest_path)
 
             print(f"   ✅ [{self.source_name}] {filename} → {display_category}/{date_folder or ''}")
@@ -700,9 +2978,10 @@ class FileHandler(FileSystemEventHandler):
             print(f"   ❌ 移动失败: {filename} - {e}")
 
 
-def watch_folders(source_folders: Dict, target_root: Path):
-    """监控多个文件夹"""
-    if not WATCHDOG_AVAILABLE:
+def watch_folders(source_folders: Dict, target_root: Path, duration: Optional[float] = None):
+    """监控多个文件夹（duration 为监控秒数，None 表示直到 Ctrl+C）"""
+    Observer = import_watchdog_observer()
+    if Observer is None:
         print("❌ 监控模式需要安装 watchdog 库")
         print("   运行: pip install watchdog")
         return
@@ -717,7 +2996,7 @@ def watch_folders(source_folders: Dict, target_root: Path):
     print(f"按 Ctrl+C 停止监控")
     print("-"*60 + "\n")
 
-    handlers = []
+    scheduler = PendingScheduler()
     observer = Observer()
 
     for name, cfg in source_folders.items():
@@ -731,8 +3010,8 @@ def watch_folders(source_folders: Dict, target_root: Path):
             target_root=target_root,
             source_name=name,
             recursive=cfg["recursive"],
+            scheduler=scheduler,
         )
-        handlers.append(handler)
 
         # Documents（非递归源且是目标）：监控设为非递归，防止反馈循环
         watch_recursive = cfg["recursive"]
@@ -743,22 +3022,46 @@ def watch_folders(source_folders: Dict, target_root: Path):
 
     observer.start()
 
+    # 启用统计时定期醒来输出（只在有新调用时输出）
+    stats_timeout = STATS_INTERVAL if _hot_path_stats is not None else None
+    next_report = time.time() + STATS_INTERVAL
+    reported_calls = 0
+
+    stop_at = time.time() + duration if duration is not None else None
+
     try:
         while True:
-            time.sleep(1)
-            for handler in handlers:
-                handler.process_pending()
+            # 睡眠到最早的截止时间，只处理到期的文件
+            timeout = stats_timeout
+            if stop_at is not None:
+                remaining = stop_at - time.time()
+                if remaining <= 0:
+                    print(f"\n\n已监控 {duration:g} 秒，停止监控...")
+                    break
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            scheduler.wait(timeout)
+            for handler, file_path_str in scheduler.pop_due(time.time()):
+                handler.process_due(file_path_str)
+            if stats_timeout is not None and time.time() >= next_report:
+                next_report = time.time() + STATS_INTERVAL
+                total_calls = _hot_path_stats.total_calls()
+                if total_calls != reported_calls:
+                    reported_calls = total_calls
+                    print_stats("性能统计（累计）")
     except KeyboardInterrupt:
         print("\n\n停止监控...")
-        observer.stop()
 
+    observer.stop()
     observer.join()
+    print_stats()
     print("✅ 监控已停止")
 
 
 # ============ 主入口 ============
 
 def main():
+    global SCAN_WORKERS, INCREMENTAL_SCAN, MOVE_WORKERS, DEDUPE, COLLECT_STATS, STREAM_PLAN
+
     parser = argparse.ArgumentParser(
         description="智能文件整理工具 v3.0",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -792,11 +3095,69 @@ def main():
         action="store_true",
         help="显示操作历史"
     )
+    parser.add_argument(
+        "--where",
+        default=None,
+        metavar="PATH",
+        help="查询某个文件被移动到了哪里"
+    )
+    parser.add_argument(
+        "--history-backend",
+        choices=sorted(HISTORY_BACKENDS),
+        default=None,
+        help=f"历史存储后端，选择会保存并用于之后的运行（默认 {HISTORY_BACKEND}）"
+    )
     parser.add_argument(
         "--no-date",
         action="store_true",
         help="不按日期归档"
     )
+    parser.add_argument(
+        "--scan-workers",
+        type=int,
+        default=None,
+        metavar="N",
+        help=f"并行扫描目录的线程数（默认 {SCAN_WORKERS}）"
+    )
+    parser.add_argument(
+        "--jobs", "-j",
+        type=int,
+        default=None,
+        metavar="N",
+        help=f"并行移动/还原文件的线程数（默认 {MOVE_WORKERS}）"
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="去重模式，目标文件夹中已有相同内容的文件不再移动"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="增量扫描，跳过自上次扫描以来未变化的目录"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="流式整理，边扫描边移动，只输出汇总（适合大量文件）"
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="输出扫描、分类、重名处理、移动、历史写入各环节的调用次数和耗时"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="在性能分析器下运行命令，结果写入历史记录所在目录"
+    )
+    parser.add_argument(
+        "--profile-seconds",
+        type=float,
+        default=60,
+        metavar="N",
+        help="与 --watch 一起使用时，采样分析 N 秒后停止监控（默认 60）"
+    )
     parser.add_argument(
         "--path", "-p",
         default=None,
@@ -815,32 +3176,74 @@ def main():
     if args.no_date:
         ARCHIVE_BY_DATE = False
 
-    # 迁移旧历史记录
+    if args.scan_workers:
+        SCAN_WORKERS = max(1, args.scan_workers)
+
+    if args.incremental:
+        INCREMENTAL_SCAN = True
+
+    if args.jobs:
+        MOVE_WORKERS = max(1, args.jobs)
+
+    if args.dedupe:
+        DEDUPE = True
+
+    if args.stream:
+        STREAM_PLAN = True
+
+    if args.stats:
+        COLLECT_STATS = True
+    if COLLECT_STATS:
+        enable_stats()
+
+    # 迁移旧历史记录，并确定历史存储后端（与上次一致，或按 --history-backend 切换）
     migrate_history_if_needed()
+    select_history_backend(args.history_backend)
 
     # 确定目标文件夹
     target_root = Path(args.target).expanduser() if args.target else TARGET_ROOT
 
-    if args.undo:
-        undo_last_batch()
-    elif args.history:
-        show_history()
-    elif args.path:
-        # 单文件夹模式（向后兼容）
-        single_path = Path(args.path).expanduser()
-        single_source = {"Custom": {"path": single_path, "recursive": True}}
-        # 单文件夹模式下，如果没有指定 --target，则目标就是源文件夹本身
-        single_target = target_root if args.target else single_path
-        if args.watch:
-            watch_folders(single_source, single_target)
+    # 分析监控模式时只运行指定时长
+    watch_duration = args.profile_seconds if args.profile else None
+
+    def run_command():
+        if args.undo:
+            undo_last_batch()
+        elif args.history:
+            show_history()
+        elif args.where:
+            show_file_moves(Path(args.where).expanduser().absolute())
+        elif args.path:
+            # 单文件夹模式（向后兼容）
+            single_path = Path(args.path).expanduser()
+            single_source = {"Custom": {"path": single_path, "recursive": True}}
+            # 单文件夹模式下，如果没有指定 --target，则目标就是源文件夹本身
+            single_target = target_root if args.target else single_path
+            if args.watch:
+                watch_folders(single_source, single_target, watch_duration)
+            else:
+                organize_files(single_source, single_target, dry_run=not args.execute)
         else:
-            organize_files(single_source, single_target, dry_run=not args.execute)
-    else:
-        # 多文件夹模式（默认）
-        if args.watch:
-            watch_folders(SOURCE_FOLDERS, target_root)
+            # 多文件夹模式（默认）
+            if args.watch:
+                watch_folders(SOURCE_FOLDERS, target_root, watch_duration)
+            else:
+                organize_files(SOURCE_FOLDERS, target_root, dry_run=not args.execute)
+
+    if args.profile:
+        if args.undo:
+            command = "undo"
+        elif args.history:
+            command = "history"
+        elif args.where:
+            command = "where"
+        elif args.watch:
+            command = "watch"
         else:
-            organize_files(SOURCE_FOLDERS, target_root, dry_run=not args.execute)
+            command = "execute" if args.execute else "preview"
+        run_profiled(command, run_command, sampling=args.watch)
+    else:
+        run_command()
 
 
 if __name__ == "__main__":